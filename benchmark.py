@@ -0,0 +1,150 @@
+import argparse
+import datetime
+import json
+from os.path import exists, join
+import platform
+import sys
+import tempfile
+import time
+
+import numpy
+
+import generate_xfer_log
+import main
+import make_plot
+import parse_xfer_data_logs
+import simulate
+
+
+stages = ['parse', 'load_cache', 'parse_logs', 'get_transfers_on_day', 'transfers_on_day', 'simulate_original',
+          'simulate', 'get_interval_statistics', 'plot_intervals']
+
+
+# time the stages of a simulation run on generated logs of different sizes and write the timings to a json file
+def main_benchmark():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='Benchmark the simulator on generated xfer logs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000, 10000000],
+                        help='number of rows of the generated logs')
+    parser.add_argument('--interval-lengths', type=float, nargs='+', default=[60, 1],
+                        help='interval lengths to simulate in seconds')
+    parser.add_argument('--days', type=float, default=7, help='number of days the generated logs span')
+    parser.add_argument('--stages', nargs='+', choices=stages, default=stages, help='stages to time')
+    parser.add_argument('--engines', nargs='+', choices=sorted(simulate.simulation_engines),
+                        default=sorted(simulate.simulation_engines), help='simulation engines to time')
+    parser.add_argument('--OD-percentage', type=float, default=0.5, help='OD percentage of the simulated scenario')
+    parser.add_argument('--repeat', type=int, default=1, help='times to repeat each stage, the fastest is kept')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the generated logs and the OD/BE split')
+    parser.add_argument('--log-dir', default=None, help='directory the generated logs are kept in between runs')
+    parser.add_argument('--output', default='benchmark_results.json', help='json file to write the results to')
+    args = parser.parse_args()
+
+    # the generated logs (unless they are kept in --log-dir) and the plots are removed after the run
+    with tempfile.TemporaryDirectory(prefix='xfer_benchmark_') as temporary_dir:
+        log_dir = simulate.ensure_folder(args.log_dir if args.log_dir is not None else temporary_dir)
+
+        results = []
+        for size in args.sizes:
+            results.extend(benchmark_log(log_dir, temporary_dir, size, args))
+
+    report = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': sys.version,
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'arguments': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w') as file_out:
+        json.dump(report, file_out, indent=2)
+
+    print("\nSaving benchmark results to %s" % args.output)
+
+
+def benchmark_log(log_dir, plot_folder, size, args):
+    start_date = datetime.date(2013, 5, 1)
+    file_name = join(log_dir, 'synthetic_{}-rows_{}-days_{}.xfer'.format(size, args.days, args.seed))
+    if not exists(file_name):
+        print('\nGenerating %s' % file_name)
+        generate_xfer_log.write_log(file_name, size, datetime.datetime.combine(start_date, datetime.time()),
+                                    args.days, seed=args.seed)
+
+    # simulate the middle day of the log, it has transfers running into it from the day before
+    date = start_date + datetime.timedelta(days=int(args.days) // 2)
+    results = []
+
+    def record(stage, function, **details):
+        result = {'rows': size, 'stage': stage}
+        result.update(details)
+        value = None
+        try:
+            seconds = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                value = function()
+                seconds.append(time.perf_counter() - start)
+            result['seconds'] = min(seconds)
+        except Exception as error:
+            result['error'] = '{}: {}'.format(type(error).__name__, error)
+
+        print(json.dumps(result))
+        results.append(result)
+        return value
+
+    columns = parse_xfer_data_logs.parse_log_columns(file_name)
+    if 'parse' in args.stages:
+        record('parse', lambda: parse_xfer_data_logs.parse_log_columns(file_name))
+    if 'load_cache' in args.stages:
+        parse_xfer_data_logs.load_log_columns(file_name)
+        record('load_cache', lambda: parse_xfer_data_logs.load_log_columns(file_name))
+    if 'parse_logs' in args.stages:
+        record('parse_logs', lambda: parse_xfer_data_logs.parse_logs(file_name))
+    if 'get_transfers_on_day' in args.stages:
+        all_transfers = columns.transfers()
+        record('get_transfers_on_day', lambda: main.get_transfers_on_day(all_transfers, date))
+        del all_transfers
+    transfer_index = parse_xfer_data_logs.TransferIndex(columns)
+    if 'transfers_on_day' in args.stages:
+        record('transfers_on_day', lambda: transfer_index.transfers_on_day(date))
+
+    transfers = transfer_index.transfers_on_day(date)
+
+    for interval_seconds in args.interval_lengths:
+        interval_length = datetime.timedelta(seconds=interval_seconds)
+        details = {'interval_length': interval_seconds, 'transfers': len(transfers)}
+
+        original_intervals = simulate.simulate_original(interval_length, date, transfers)
+        if 'simulate_original' in args.stages:
+            record('simulate_original', lambda: simulate.simulate_original(interval_length, date, transfers),
+                   **details)
+        if 'get_interval_statistics' in args.stages:
+            record('get_interval_statistics', lambda: simulate.get_interval_statistics(original_intervals),
+                   **details)
+        if 'plot_intervals' in args.stages:
+            plot_filename = join(plot_folder, 'original_{}.png'.format(interval_seconds))
+            record('plot_intervals', lambda: make_plot.plot_intervals(plot_filename, 'benchmark',
+                                                                      [('Original', original_intervals)]), **details)
+
+        if 'simulate' not in args.stages:
+            continue
+
+        mean = simulate.get_interval_statistics(original_intervals)[0]
+        scenario = {'seed': args.seed, 'network_capacity': mean * 2}
+        for heuristic_name, heuristic_function in sorted(simulate.heuristics.items()):
+            for engine in args.engines:
+                simulate_function = simulate.simulation_engines[engine]
+
+                def run_scenario():
+                    OD_transfers, BE_transfers = simulate.split_OD_transfers(transfers, args.OD_percentage,
+                                                                             scenario['seed'])
+                    return simulate_function(interval_length, date, OD_transfers, BE_transfers,
+                                             scenario['network_capacity'], heuristic_function)
+
+                record('simulate', run_scenario, heuristic=heuristic_name, engine=engine, **details)
+
+    return results
+
+
+if __name__ == "__main__":
+    main_benchmark()
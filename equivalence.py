@@ -0,0 +1,367 @@
+import argparse
+import datetime
+import json
+from os.path import exists, join
+import platform
+import sys
+import tempfile
+import time
+
+import numpy
+
+import generate_xfer_log
+import interval_statistics
+import parse_xfer_data_logs
+import simulate
+
+
+# the engines checked against each other, the intervals and transfer completion times of every engine are checked
+# against the reference_engine's, the original per-transfer loop
+engines = dict(simulate.simulation_engines, loop=simulate.simulate_loop)
+
+reference_engine = 'loop'
+
+
+# the parsers checked against each other, the transfers of every parser are checked against the reference_parser's
+parsers = {
+    'eval': parse_xfer_data_logs.parse_logs_eval,
+    'columns': lambda file_name: parse_xfer_data_logs.parse_log_columns(file_name).transfers(),
+    'cache': lambda file_name: parse_xfer_data_logs.load_log_columns(file_name).transfers(),
+    'stream': lambda file_name: list(parse_xfer_data_logs.iter_log_transfers(file_name)),
+}
+
+reference_parser = 'eval'
+
+# the attributes of the parsed transfers that have to be the same for every parser
+parsed_attributes = ['transfer_id', 'ip_address', 'requested_start_time', 'requested_transfer_time', 'total_bytes',
+                     'trans_type']
+
+
+# (mean, std deviation, median) of an IntervalSeries from the streaming statistics of interval_statistics
+def sketch_statistics(intervals, relative_accuracy=interval_statistics.default_relative_accuracy):
+    statistics = interval_statistics.IntervalStatistics(relative_accuracy=relative_accuracy)
+    statistics.record_series(intervals)
+    return statistics.statistics()
+
+
+# the shapes of the generated logs, as keyword arguments of generate_xfer_log.write_log
+log_shapes = {
+    'poisson': {'arrivals': 'poisson', 'sizes': 'lognormal', 'durations': 'lognormal'},
+    'diurnal_pareto': {'arrivals': 'diurnal', 'sizes': 'pareto', 'durations': 'exponential'},
+    'bursty': {'arrivals': 'diurnal', 'sizes': 'exponential', 'durations': 'lognormal', 'mean_duration': 60},
+}
+
+
+# check that the alternative engines, parsers and interval statistics give the same answers as the reference ones on
+# generated (and given) logs, over a grid of interval lengths, OD percentages, network capacities and seeds. Every
+# comparison is printed and written to a json file with how long the alternative took relative to the reference, and
+# the exit status is 1 if any of them differ by more than the tolerances
+def main_equivalence():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='Check the simulation engines, log parsers and interval statistics '
+                                                 'against their reference implementations')
+    parser.add_argument('--logs', nargs='+', default=[], help='xfer logs to check on top of the generated ones')
+    parser.add_argument('--shapes', nargs='*', choices=sorted(log_shapes), default=sorted(log_shapes),
+                        help='shapes of the generated logs')
+    parser.add_argument('--rows', type=int, default=5000, help='number of rows of the generated logs')
+    parser.add_argument('--days', type=float, default=3, help='number of days the generated logs span')
+    parser.add_argument('--engines', nargs='*', default=None,
+                        choices=sorted(set(engines) - {reference_engine}),
+                        help='engines to check against the {} engine (default: all of them)'.format(reference_engine))
+    parser.add_argument('--heuristic', nargs='+', choices=sorted(simulate.heuristics),
+                        default=sorted(simulate.heuristics), help='heuristics to simulate')
+    parser.add_argument('--queue-order', choices=sorted(simulate.queue_orders), default='arrival',
+                        help='order queued transfers are run in')
+    parser.add_argument('--interval-lengths', type=float, nargs='+', default=[60, 10],
+                        help='interval lengths to simulate in seconds')
+    parser.add_argument('--OD-percentages', type=float, nargs='+', default=[0.25, 0.5, 1],
+                        help='OD percentages to simulate')
+    parser.add_argument('--capacities', type=float, nargs='+', default=[1, 2],
+                        help='network capacities to simulate, as multiples of the mean of the Original intervals')
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0, 1], help='seeds of the OD/BE splits')
+    parser.add_argument('--byte-tolerance', type=float, default=1,
+                        help='bytes an interval may differ by (on top of the relative tolerance)')
+    parser.add_argument('--relative-tolerance', type=float, default=1e-9,
+                        help='relative difference allowed in the interval bytes and the interval statistics')
+    parser.add_argument('--time-tolerance', type=int, default=1,
+                        help='microseconds the completion time of a transfer may differ by')
+    parser.add_argument('--quantile-accuracy', type=float, default=interval_statistics.default_relative_accuracy,
+                        help='relative accuracy of the streaming interval statistics that are checked')
+    parser.add_argument('--no-parsers', action='store_true', help="don't check the parsers")
+    parser.add_argument('--seed', type=int, default=0, help='seed for the generated logs')
+    parser.add_argument('--log-dir', default=None, help='directory the generated logs are kept in between runs')
+    parser.add_argument('--output', default='equivalence_results.json', help='json file to write the results to')
+    args = parser.parse_args()
+
+    if args.engines is None:
+        args.engines = sorted(set(engines) - {reference_engine})
+
+    # the generated logs are removed after the run, unless they are kept in --log-dir
+    with tempfile.TemporaryDirectory(prefix='xfer_equivalence_') as temporary_dir:
+        log_dir = simulate.ensure_folder(args.log_dir if args.log_dir is not None else temporary_dir)
+
+        start_date = datetime.date(2013, 5, 1)
+        file_names = []
+        for shape in args.shapes:
+            file_name = join(log_dir, 'synthetic_{}_{}-rows_{}-days_{}.xfer'.format(shape, args.rows, args.days,
+                                                                                   args.seed))
+            if not exists(file_name):
+                print('\nGenerating %s' % file_name)
+                generate_xfer_log.write_log(file_name, args.rows,
+                                            datetime.datetime.combine(start_date, datetime.time()), args.days,
+                                            seed=args.seed, **log_shapes[shape])
+            file_names.append(file_name)
+        file_names.extend(args.logs)
+
+        results = []
+        for file_name in file_names:
+            if not args.no_parsers:
+                results.extend(check_parsers(file_name))
+            results.extend(check_log(file_name, args))
+
+    failures = [result for result in results if not result['equivalent']]
+
+    report = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': sys.version,
+        'numpy': numpy.__version__,
+        'platform': platform.platform(),
+        'arguments': vars(args),
+        'comparisons': len(results),
+        'failures': len(failures),
+        'results': results,
+    }
+    with open(args.output, 'w') as file_out:
+        json.dump(report, file_out, indent=2)
+
+    print('\n{} of {} comparisons are equivalent'.format(len(results) - len(failures), len(results)))
+    print("Saving equivalence results to %s" % args.output)
+    if len(failures) > 0:
+        sys.exit(1)
+
+
+# time a function, returning its value and the seconds it took
+def timed(function, *arguments):
+    start = time.perf_counter()
+    value = function(*arguments)
+    return value, time.perf_counter() - start
+
+
+# the ratio of the alternative's runtime to the reference's, above 1 when the alternative is slower
+def runtime_ratio(reference_seconds, alternative_seconds):
+    return alternative_seconds / reference_seconds if reference_seconds > 0 else None
+
+
+# compare the transfers of every parser to the ones of the reference parser, attribute by attribute
+def check_parsers(file_name):
+    # the cache is written before the parsers are timed, so the 'cache' parser times reading it
+    parse_xfer_data_logs.load_log_columns(file_name)
+
+    reference_transfers, reference_seconds = timed(parsers[reference_parser], file_name)
+
+    results = []
+    for parser_name, parse in sorted(parsers.items()):
+        if parser_name == reference_parser:
+            continue
+
+        transfers, seconds = timed(parse, file_name)
+        mismatches = {attribute: sum(getattr(reference, attribute) != getattr(transfer, attribute)
+                                     for reference, transfer in zip(reference_transfers, transfers))
+                      for attribute in parsed_attributes}
+
+        result = {
+            'log': file_name,
+            'check': 'parser',
+            'parser': parser_name,
+            'transfers': len(transfers),
+            'missing_transfers': abs(len(transfers) - len(reference_transfers)),
+            'mismatches': {attribute: count for attribute, count in mismatches.items() if count > 0},
+            'reference_seconds': reference_seconds,
+            'seconds': seconds,
+            'runtime_ratio': runtime_ratio(reference_seconds, seconds),
+        }
+        result['equivalent'] = result['missing_transfers'] == 0 and len(result['mismatches']) == 0
+        print(json.dumps(result))
+        results.append(result)
+
+    return results
+
+
+# simulate the middle day of a log with the reference engine and every alternative engine over the grid of the
+# arguments and compare their intervals and transfer completion times. The Original intervals of simulate_original are
+# checked against the reference engine simulating every transfer as OD, and their interval statistics are checked
+def check_log(file_name, args):
+    transfer_index = parse_xfer_data_logs.TransferIndex(parse_xfer_data_logs.load_log_columns(file_name))
+    if len(transfer_index.start_times) == 0:
+        return []
+
+    first_date = parse_xfer_data_logs.to_datetime(int(transfer_index.start_times[0])).date()
+    last_date = parse_xfer_data_logs.to_datetime(int(transfer_index.start_times[-1])).date()
+    date = first_date + (last_date - first_date) // 2
+    transfers = transfer_index.transfers_on_day(date)
+
+    results = []
+    for interval_seconds in args.interval_lengths:
+        interval_length = datetime.timedelta(seconds=interval_seconds)
+        original_intervals = simulate.simulate_original(interval_length, date, transfers)
+        mean = simulate.get_interval_statistics(original_intervals)[0]
+
+        details = {'log': file_name, 'date': str(date), 'transfers': len(transfers),
+                   'interval_length': interval_seconds}
+
+        result = dict(details, check='original')
+        result.update(check_original(transfers, interval_length, date, original_intervals, args))
+        print(json.dumps(result))
+        results.append(result)
+
+        result = dict(details, check='statistics')
+        result.update(compare_statistics(original_intervals, args))
+        print(json.dumps(result))
+        results.append(result)
+
+        for heuristic_name in args.heuristic:
+            for OD_percentage in args.OD_percentages:
+                for capacity in args.capacities:
+                    for seed in args.seeds:
+                        heuristic_tup = (heuristic_name, simulate.heuristics[heuristic_name])
+                        scenario = simulate.make_scenario(interval_length, date, heuristic_tup,
+                                                          queue_order=args.queue_order, seed=seed,
+                                                          network_capacity=mean * capacity)
+                        scenario['simulate_function'] = engines[reference_engine]
+                        (reference_intervals, reference_metrics), reference_seconds = \
+                            timed(simulate.simulate_OD_scenario, transfers, OD_percentage, scenario)
+
+                        for engine in args.engines:
+                            scenario['simulate_function'] = engines[engine]
+                            (new_intervals, metrics), seconds = \
+                                timed(simulate.simulate_OD_scenario, transfers, OD_percentage, scenario)
+
+                            result = dict(details, check='engine', engine=engine, heuristic=heuristic_name,
+                                          OD_percentage=OD_percentage, capacity=capacity, seed=seed)
+                            result.update(compare_intervals(reference_intervals, new_intervals, args))
+                            result.update(compare_completion_times(reference_metrics, metrics, args))
+                            result['reference_seconds'] = reference_seconds
+                            result['seconds'] = seconds
+                            result['runtime_ratio'] = runtime_ratio(reference_seconds, seconds)
+                            result['equivalent'] = result['intervals_over_tolerance'] == 0 and \
+                                result['transfers_over_tolerance'] == 0 and result['missing_transfers'] == 0
+                            print(json.dumps(result))
+                            results.append(result)
+
+    return results
+
+
+# compare the Original intervals of simulate_original with the reference engine simulating all of the transfers as OD
+# (and no network capacity, which OD transfers don't wait for)
+def check_original(transfers, interval_length, date, original_intervals, args):
+    OD_transfers, BE_transfers = simulate.split_OD_transfers(transfers, 1)
+    reference_intervals, reference_seconds = timed(engines[reference_engine], interval_length, date, OD_transfers,
+                                                   BE_transfers, 0, simulate.heuristics['baseline'])
+    _, seconds = timed(simulate.simulate_original, interval_length, date, transfers)
+
+    result = compare_intervals(reference_intervals, original_intervals, args)
+    result['reference_seconds'] = reference_seconds
+    result['seconds'] = seconds
+    result['runtime_ratio'] = runtime_ratio(reference_seconds, seconds)
+    result['equivalent'] = result['intervals_over_tolerance'] == 0
+    return result
+
+
+# the OD bytes, BE bytes, OD counts and BE counts of two IntervalSeries (rows of a 4 x intervals array each) on the
+# intervals of both of them, the intervals one of them doesn't have are 0
+def aligned_interval_columns(reference, alternative):
+    if reference.length != alternative.length:
+        raise ValueError('Can not compare intervals of {} and {} microseconds'.format(reference.length,
+                                                                                     alternative.length))
+
+    start_time = min(reference.start_time, alternative.start_time)
+    num_intervals = (max(reference.end_time, alternative.end_time) - start_time) // reference.length
+
+    aligned = []
+    for intervals in (reference, alternative):
+        offset = (intervals.start_time - start_time) // intervals.length
+        columns = numpy.zeros((4, num_intervals))
+        columns[:, offset:offset + len(intervals)] = [intervals.OD_bytes, intervals.BE_bytes, intervals.OD_counts,
+                                                      intervals.BE_counts]
+        aligned.append(columns)
+    return aligned
+
+
+# the differences of the bytes of every interval, an interval is over the tolerance if its OD or BE bytes differ by
+# more than the byte tolerance plus the relative tolerance of the reference's bytes, or if its transfer counts differ
+def compare_intervals(reference, alternative, args):
+    reference_columns, alternative_columns = aligned_interval_columns(reference, alternative)
+    byte_differences = numpy.abs(alternative_columns[:2] - reference_columns[:2])
+    byte_tolerances = args.byte_tolerance + args.relative_tolerance * numpy.abs(reference_columns[:2])
+    count_mismatches = (alternative_columns[2:] != reference_columns[2:]).any(axis=0)
+
+    over_tolerance = (byte_differences > byte_tolerances).any(axis=0) | count_mismatches
+    total_bytes = numpy.abs(reference_columns[:2]).sum()
+
+    return {
+        'intervals': reference_columns.shape[1],
+        'interval_count_difference': len(alternative) - len(reference),
+        'max_byte_difference': float(byte_differences.max()) if byte_differences.size > 0 else 0.0,
+        'total_byte_difference': float(byte_differences.sum()),
+        'relative_byte_difference': float(byte_differences.sum() / total_bytes) if total_bytes > 0 else 0.0,
+        'count_mismatches': int(count_mismatches.sum()),
+        'intervals_over_tolerance': int(over_tolerance.sum()),
+        'first_interval_over_tolerance': str(parse_xfer_data_logs.to_datetime(
+            min(reference.start_time, alternative.start_time) + int(over_tolerance.argmax()) * reference.length))
+        if over_tolerance.any() else None,
+    }
+
+
+# the completion times of the transfers recorded by two TransferMetrics, by transfer id and requested start time
+def completion_times(metrics):
+    return dict(zip(zip(metrics.transfer_ids, metrics.requested_start_times), metrics.end_times))
+
+
+# the differences of the completion time of every transfer, transfers only one of the simulations finished are missing
+def compare_completion_times(reference_metrics, metrics, args):
+    reference_end_times = completion_times(reference_metrics)
+    end_times = completion_times(metrics)
+
+    shared_keys = [key for key in reference_end_times if key in end_times]
+    differences = numpy.abs(numpy.array([end_times[key] - reference_end_times[key] for key in shared_keys],
+                                        dtype=numpy.int64))
+
+    return {
+        'finished_transfers': len(reference_end_times),
+        'missing_transfers': len(reference_end_times) + len(end_times) - 2 * len(shared_keys),
+        'max_completion_difference': int(differences.max()) if len(differences) > 0 else 0,
+        'mean_completion_difference': float(differences.mean()) if len(differences) > 0 else 0.0,
+        'transfers_over_tolerance': int((differences > args.time_tolerance).sum()),
+    }
+
+
+# compare the streaming interval statistics with get_interval_statistics. The mean and std deviation have to be within
+# the relative tolerance and the median has to be within the quantile accuracy of a load between the two middle loads
+# (numpy's median is their mean when there is an even number of intervals)
+def compare_statistics(intervals, args):
+    (mean, std, median), reference_seconds = timed(simulate.get_interval_statistics, intervals)
+    (sketch_mean, sketch_std, sketch_median), seconds = timed(sketch_statistics, intervals, args.quantile_accuracy)
+
+    loads = numpy.sort(intervals.network_loads())
+    low_median = loads[(len(loads) - 1) // 2] * (1 - args.quantile_accuracy)
+    high_median = loads[len(loads) // 2] * (1 + args.quantile_accuracy)
+
+    def within(value, reference):
+        return abs(value - reference) <= args.relative_tolerance * abs(reference) + 1e-9
+
+    result = {
+        'mean_difference': float(sketch_mean - mean),
+        'std_difference': float(sketch_std - std),
+        'median_difference': float(sketch_median - median),
+        'reference_seconds': reference_seconds,
+        'seconds': seconds,
+        'runtime_ratio': runtime_ratio(reference_seconds, seconds),
+    }
+    result['equivalent'] = bool(within(sketch_mean, mean) and within(sketch_std, std) and
+                                low_median <= sketch_median <= high_median)
+    return result
+
+
+if __name__ == "__main__":
+    main_equivalence()
@@ -0,0 +1,129 @@
+import argparse
+import datetime
+import numpy
+
+
+# write a synthetic xfer log in the same pipe delimited format parse_xfer_data_logs.parse_logs reads
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic xfer log')
+    parser.add_argument('file_name', help='log file to write')
+    parser.add_argument('--rows', type=int, default=10000, help='number of transfers')
+    parser.add_argument('--start-date', default='2013-05-01', help="first day of the log ('%%Y-%%m-%%d')")
+    parser.add_argument('--days', type=float, default=7, help='number of days the transfers are requested over')
+    parser.add_argument('--arrivals', choices=sorted(arrival_processes), default='poisson',
+                        help='process the transfer requests arrive by')
+    parser.add_argument('--sizes', choices=sorted(size_distributions), default='lognormal',
+                        help='distribution of the transfer sizes')
+    parser.add_argument('--mean-size', type=float, default=100 * 1024 * 1024, help='mean transfer size in bytes')
+    parser.add_argument('--durations', choices=sorted(duration_distributions), default='lognormal',
+                        help='distribution of the transfer times')
+    parser.add_argument('--mean-duration', type=float, default=600, help='mean transfer time in seconds')
+    parser.add_argument('--OD-fraction', type=float, default=0.5, help="fraction of transfers with trans_type 0 (OD)")
+    parser.add_argument('--ip-addresses', type=int, default=16, help='number of distinct ip addresses')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the random generator')
+    args = parser.parse_args()
+
+    start_time = datetime.datetime.strptime(args.start_date, "%Y-%m-%d")
+    write_log(args.file_name, args.rows, start_time, args.days, args.arrivals, args.sizes, args.mean_size,
+              args.durations, args.mean_duration, args.OD_fraction, args.ip_addresses, args.seed)
+
+
+def write_log(file_name, rows, start_time, days, arrivals='poisson', sizes='lognormal', mean_size=100 * 1024 * 1024,
+              durations='lognormal', mean_duration=600, OD_fraction=0.5, ip_addresses=16, seed=None):
+    rng = numpy.random.default_rng(seed)
+
+    # all of the times are in microseconds
+    span = int(days * 86400 * 1000000)
+    start_times = arrival_processes[arrivals](rng, rows, span)
+    transfer_times = duration_distributions[durations](rng, rows, mean_duration * 1000000)
+    # the parser reads transfer times as '%H:%M:%S.%f', so they have to be shorter than a day and longer than 0
+    transfer_times = numpy.clip(transfer_times, 1, 86400 * 1000000 - 1).astype(numpy.int64)
+    num_bytes = numpy.maximum(size_distributions[sizes](rng, rows, mean_size), 1).astype(numpy.int64)
+    trans_types = (rng.random(rows) >= OD_fraction).astype(numpy.int64)
+    ip_idx = rng.integers(0, ip_addresses, rows)
+
+    start_strings = numpy.datetime_as_string(numpy.datetime64(start_time, 'us') +
+                                             start_times.astype('timedelta64[us]'), unit='us')
+
+    with open(file_name, 'w') as file_out:
+        file_out.write(' id | ip_address | start_time | transfer_time | num_bytes | trans_type\n')
+        file_out.write('----+------------+------------+---------------+-----------+------------\n')
+
+        chunk_size = 65536
+        for chunk_start in range(0, rows, chunk_size):
+            chunk = slice(chunk_start, chunk_start + chunk_size)
+            rows_out = zip(range(chunk_start, chunk_start + chunk_size), ip_idx[chunk].tolist(),
+                           start_strings[chunk].tolist(), transfer_times[chunk].tolist(),
+                           num_bytes[chunk].tolist(), trans_types[chunk].tolist())
+
+            file_out.write(''.join(' {} | 10.0.{}.{} | {} | {} | {} | {}\n'.format(
+                transfer_id, ip // 256, ip % 256, start.replace('T', ' '), format_transfer_time(transfer_time),
+                size, trans_type) for transfer_id, ip, start, transfer_time, size, trans_type in rows_out))
+
+        file_out.write('({} rows)\n'.format(rows))
+
+
+def format_transfer_time(microseconds):
+    seconds, microseconds = divmod(microseconds, 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return '{:02d}:{:02d}:{:02d}.{:06d}'.format(hours, minutes, seconds, microseconds)
+
+
+# arrival processes give sorted request times in microseconds from the start of the log
+def poisson_arrivals(rng, rows, span):
+    gaps = rng.exponential(1.0, rows + 1)
+    return (numpy.cumsum(gaps)[:-1] / gaps.sum() * span).astype(numpy.int64)
+
+
+def uniform_arrivals(rng, rows, span):
+    return numpy.sort(rng.integers(0, span, rows))
+
+
+# poisson arrivals with a daily cycle, peaking in the afternoon at 3 times the rate of the early morning
+def diurnal_arrivals(rng, rows, span):
+    arrivals = []
+    while sum(len(chunk) for chunk in arrivals) < rows:
+        candidates = rng.integers(0, span, rows)
+        day_fraction = (candidates % (86400 * 1000000)) / (86400 * 1000000.0)
+        intensity = (2 - numpy.cos(2 * numpy.pi * (day_fraction - 0.125))) / 3
+        arrivals.append(candidates[rng.random(rows) < intensity])
+    return numpy.sort(numpy.concatenate(arrivals)[:rows])
+
+
+arrival_processes = {
+    'poisson': poisson_arrivals,
+    'uniform': uniform_arrivals,
+    'diurnal': diurnal_arrivals,
+}
+
+
+def lognormal(rng, rows, mean, sigma=1.5):
+    return rng.lognormal(numpy.log(mean) - sigma ** 2 / 2, sigma, rows)
+
+
+def exponential(rng, rows, mean):
+    return rng.exponential(mean, rows)
+
+
+# pareto with shape 1.5, a heavy tail of a few very large transfers
+def pareto(rng, rows, mean, shape=1.5):
+    return (rng.pareto(shape, rows) + 1) * mean * (shape - 1) / shape
+
+
+size_distributions = {
+    'lognormal': lognormal,
+    'exponential': exponential,
+    'pareto': pareto,
+}
+
+duration_distributions = {
+    'lognormal': lognormal,
+    'exponential': exponential,
+}
+
+
+if __name__ == "__main__":
+    main()
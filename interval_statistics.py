@@ -0,0 +1,164 @@
+import math
+import numpy
+
+from parse_xfer_data_logs import microseconds_per_second, to_datetime
+
+
+default_relative_accuracy = 0.01
+
+default_quantiles = [0.5, 0.9, 0.95, 0.99]
+
+
+# statistics of the network load (bytes/second) of intervals that are added as they are simulated, without keeping
+# the intervals. The mean and variance are kept with Welford's algorithm and quantiles come from a histogram of
+# logarithmic buckets, every bucket covering loads within relative_accuracy of its middle, so any quantile is within
+# relative_accuracy of a load at that rank. Memory only grows with the log of the range of the loads, not with the
+# number of intervals. The peak load, and the time spent above network_capacity (if given) are kept too. Statistics
+# with the same accuracy can be merged, e.g. those of several sites or workers
+class IntervalStatistics(object):
+    def __init__(self, network_capacity=None, relative_accuracy=default_relative_accuracy):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('The relative accuracy has to be between 0 and 1 - {}'.format(relative_accuracy))
+
+        self.network_capacity = network_capacity
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.inverse_log_gamma = 1 / math.log(self.gamma)
+
+        self.count = 0
+        self.mean = 0.0
+        self.squared_deviations = 0.0
+        self.peak = None
+        self.peak_time = None
+        # microseconds of the intervals added and of the ones above network_capacity
+        self.duration = 0
+        self.time_above_capacity = 0
+
+        # loads of 0 (idle intervals) have no logarithm and are counted on their own
+        self.zero_count = 0
+        self.buckets = {}
+
+    def __len__(self):
+        return self.count
+
+    # add a finished Interval
+    def record(self, interval):
+        self.add(interval.network_load(), interval.start_time, interval.length)
+
+    # add the network load of an interval starting at start_time and length long (microseconds)
+    def add(self, value, start_time, length):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.squared_deviations += delta * (value - self.mean)
+
+        if self.peak is None or value > self.peak:
+            self.peak = value
+            self.peak_time = start_time
+
+        self.duration += length
+        if self.network_capacity is not None and value > self.network_capacity:
+            self.time_above_capacity += length
+
+        if value > 0:
+            bucket = math.ceil(math.log(value) * self.inverse_log_gamma)
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        else:
+            self.zero_count += 1
+
+    # add all of the intervals of an IntervalSeries at once
+    def record_series(self, intervals):
+        if len(intervals) == 0:
+            return
+
+        values = intervals.network_loads()
+        statistics = IntervalStatistics(self.network_capacity, self.relative_accuracy)
+        statistics.count = len(values)
+        statistics.mean = float(values.mean())
+        statistics.squared_deviations = float(((values - statistics.mean) ** 2).sum())
+
+        peak_idx = int(values.argmax())
+        statistics.peak = float(values[peak_idx])
+        statistics.peak_time = intervals.start_time + peak_idx * intervals.length
+
+        statistics.duration = len(values) * intervals.length
+        if self.network_capacity is not None:
+            statistics.time_above_capacity = int((values > self.network_capacity).sum()) * intervals.length
+
+        positive_values = values[values > 0]
+        statistics.zero_count = len(values) - len(positive_values)
+        buckets, counts = numpy.unique(numpy.ceil(numpy.log(positive_values) * self.inverse_log_gamma),
+                                       return_counts=True)
+        statistics.buckets = dict(zip(buckets.astype(numpy.int64).tolist(), counts.tolist()))
+
+        self.merge(statistics)
+
+    # add the intervals of other statistics with the same relative accuracy
+    def merge(self, statistics):
+        if statistics.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Can not merge statistics with a relative accuracy of {} into ones of {}'.
+                             format(statistics.relative_accuracy, self.relative_accuracy))
+        if statistics.count == 0:
+            return
+
+        count = self.count + statistics.count
+        delta = statistics.mean - self.mean
+        self.squared_deviations += statistics.squared_deviations + delta * delta * self.count * statistics.count / count
+        self.mean += delta * statistics.count / count
+        self.count = count
+
+        if self.peak is None or statistics.peak > self.peak:
+            self.peak = statistics.peak
+            self.peak_time = statistics.peak_time
+
+        self.duration += statistics.duration
+        self.time_above_capacity += statistics.time_above_capacity
+
+        self.zero_count += statistics.zero_count
+        for bucket, bucket_count in statistics.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + bucket_count
+
+    # the population standard deviation, like numpy.std
+    def std(self):
+        return math.sqrt(self.squared_deviations / self.count) if self.count > 0 else 0.0
+
+    # the load at rank quantile * (count - 1) of the sorted loads, to within the relative accuracy
+    def quantile(self, quantile):
+        if self.count == 0:
+            return 0.0
+
+        rank = quantile * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                # the middle (in relative terms) of the loads between gamma ** (bucket - 1) and gamma ** bucket
+                return 2 * self.gamma ** bucket / (self.gamma + 1)
+        return self.peak
+
+    def median(self):
+        return self.quantile(0.5)
+
+    # (mean, std deviation, median) like get_interval_statistics
+    def statistics(self):
+        return self.mean, self.std(), self.median()
+
+    def print_summary(self, printer, quantiles=default_quantiles):
+        bytes_per_megabyte = 1024 * 1024
+
+        print('\n' + printer)
+        print("mean Interval value: {} MiB/Second".format(self.mean / bytes_per_megabyte))
+        print("median Interval value: {} MiB/Second".format(self.median() / bytes_per_megabyte))
+        print("std deviation: {}".format(self.std() / bytes_per_megabyte))
+        print('quantiles (to within {:.2%}): '.format(self.relative_accuracy) +
+              ', '.join('p{:g}: {:.3f}'.format(quantile * 100, self.quantile(quantile) / bytes_per_megabyte)
+                        for quantile in quantiles) + ' MiB/Second')
+        if self.peak is not None:
+            print("peak Interval value: {} MiB/Second at {}".format(self.peak / bytes_per_megabyte,
+                                                                   to_datetime(self.peak_time)))
+        if self.network_capacity is not None and self.duration > 0:
+            print("time above capacity: {} seconds ({:.2%} of the time)".
+                  format(self.time_above_capacity / microseconds_per_second,
+                         self.time_above_capacity / self.duration))
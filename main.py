@@ -1,52 +1,225 @@
-import sys
+import argparse
 from os.path import isfile
 import datetime
 
 import parse_xfer_data_logs
+import profiling
+import save_output
 import simulate
+import site_config
 
 
 def main():
     '''Main function'''
 
-    if len(sys.argv) < 3 or len(sys.argv) > 3:
-        print("Received %d arguments - Expected 2 (log file filename, and date to simulate)" % (len(sys.argv) - 1))
-        print('Example: xfer_data_logs/128.142.18.166.xfer 2013-5-3')
-        raise SystemExit
+    parser = argparse.ArgumentParser(description='Simulate the transfers of an xfer log',
+                                     epilog='Example: xfer_data_logs/128.142.18.166.xfer 2013-5-1 2013-5-31 '
+                                            '--heuristic baseline fair_share')
+    parser.add_argument('file_name', help='xfer log file')
+    parser.add_argument('--logs', nargs='+', default=[],
+                        help='more xfer log files whose transfers are simulated together with the ones of file_name')
+    parser.add_argument('date', help="date to simulate ('%%Y-%%m-%%d')")
+    parser.add_argument('last_date', nargs='?', default=None,
+                        help="last date of a range of dates to simulate ('%%Y-%%m-%%d')")
+    parser.add_argument('--heuristic', nargs='+', choices=sorted(simulate.heuristics), default=['baseline'],
+                        help='heuristics to simulate, giving several compares them side by side')
+    parser.add_argument('--engine', choices=sorted(simulate.simulation_engines), default='interval',
+                        help='simulation engine')
+    parser.add_argument('--queue-order', choices=sorted(simulate.queue_orders), default='arrival',
+                        help='order queued transfers are run in')
+    parser.add_argument('--interval-length', type=float, default=60, help='interval length in seconds')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes to run the scenarios on (default: run them one after another)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the OD/BE splits')
+    parser.add_argument('--replications', type=int, default=None,
+                        help='number of seeded OD/BE splits to simulate per OD percentage, summarized with '
+                             'Student\'s t confidence intervals instead of plotted')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='confidence level of the confidence intervals of the replications')
+    parser.add_argument('--capacity-target', type=float, default=None,
+                        help='search for the smallest network capacity at which the BE transfers meet this target '
+                             'instead of simulating the OD percentages')
+    parser.add_argument('--target-metric', choices=simulate.capacity_targets, default='slowdown',
+                        help='BE transfer outcome the capacity target is for')
+    parser.add_argument('--target-percentile', type=float, default=95,
+                        help='percentile of the BE transfer outcomes that has to meet the capacity target')
+    parser.add_argument('--OD-percentage', type=float, default=0.5,
+                        help='OD percentage of the capacity search, --stream and --sites')
+    parser.add_argument('--save-output', nargs='+', choices=save_output.output_formats, default=[],
+                        help='formats to save the intervals and transfer outcomes of every scenario in, to the '
+                             'output_logs folder')
+    parser.add_argument('--aggregate-lengths', type=float, nargs='+', default=[],
+                        help='interval lengths in seconds (multiples of the interval length) to also aggregate the '
+                             'simulated intervals into')
+    parser.add_argument('--no-plot', action='store_true', help="don't plot the scenarios (never imports matplotlib)")
+    parser.add_argument('--plot-workers', type=int, default=1,
+                        help='number of processes rendering plots while the scenarios are simulated (0 renders them '
+                             'one after another)')
+    parser.add_argument('--stream', action='store_true',
+                        help='simulate the dates as one run while the log is read, for logs ordered by start time '
+                             'that are too large to load. The intervals and transfer outcomes are saved as csv to the '
+                             'output_logs folder')
+    parser.add_argument('--network-capacity', type=float, default=None,
+                        help='network capacity in MiB/s of --stream')
+    parser.add_argument('--quantile-accuracy', type=float, default=0.01,
+                        help='relative accuracy of the interval quantiles of --stream, which are kept while the '
+                             'intervals are simulated instead of keeping the intervals')
+    parser.add_argument('--profile', nargs='*', choices=profiling.capture_options, default=None,
+                        help='time the phases of the run and count what the simulation does, writing a json report '
+                             'to the plots folder. Each scenario can also be captured with cProfile or tracemalloc')
+    parser.add_argument('--sites', nargs='?', const='', default=None, metavar='CONFIG',
+                        help='simulate every ip address (or subnet) as a link of its own at --OD-percentage and merge '
+                             'them, with the capacities of the site config file (see site_config.load_site_config). '
+                             'Without a config file every ip address is a site with twice its Original mean')
+    args = parser.parse_args()
 
-    file_name = sys.argv[1]
-    if isfile(file_name):
-        file_name = file_name
-    else:
-        print("Input string is not a valid file_name - %s" % (file_name))
-        raise SystemExit
+    # the intervals are simulated in whole microseconds
+    if datetime.timedelta(seconds=args.interval_length) < datetime.timedelta(microseconds=1):
+        parser.error('--interval-length has to be at least a microsecond')
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers has to be at least 1')
+    if not 0 <= args.OD_percentage <= 1:
+        parser.error('--OD-percentage has to be between 0 and 1')
+    if args.replications is not None and args.replications < 1:
+        parser.error('--replications has to be at least 1')
+    if not 0 < args.confidence < 1:
+        parser.error('--confidence has to be between 0 and 1')
+    # the modes replace the simulation of the OD percentages in different ways, so only one of them can be asked for
+    modes = [option for option, given in [('--sites', args.sites is not None),
+                                          ('--capacity-target', args.capacity_target is not None),
+                                          ('--replications', args.replications is not None)] if given]
+    if len(modes) > 1:
+        parser.error('only one of {} can be given'.format(', '.join(modes)))
+    if args.stream:
+        # a stream is one interval engine run over a single log, so the options it can't honour are errors rather
+        # than being silently ignored
+        if args.network_capacity is None:
+            parser.error('--stream needs a --network-capacity')
+        if args.network_capacity <= 0:
+            parser.error('--network-capacity has to be larger than 0')
+        unsupported_options = [('--engine', args.engine != 'interval'), ('--logs', len(args.logs) > 0),
+                               ('--workers', args.workers is not None), ('--sites', args.sites is not None),
+                               ('--replications', args.replications is not None),
+                               ('--capacity-target', args.capacity_target is not None),
+                               ('--save-output', len(args.save_output) > 0),
+                               ('--aggregate-lengths', len(args.aggregate_lengths) > 0)]
+        for option, given in unsupported_options:
+            if given:
+                parser.error('{} is not supported with --stream'.format(option))
+
+    file_name = args.file_name
+    for log_file_name in [file_name] + args.logs:
+        if not isfile(log_file_name):
+            print("Input string is not a valid file_name - %s" % (log_file_name))
+            raise SystemExit
 
     # plots_folder = 'plots-xfer_data_logs'
     # # verify that the plots output folder exists, if it doesn't, then create it
     # if not exists(plots_folder):
     #     makedirs(plots_folder)
 
-    try:
-        date_time = datetime.datetime.strptime(sys.argv[2], "%Y-%m-%d")
-        date = date_time.date()
-    except:
-        print("Input string is not a correctly formatted date of form ('%Y-%m-%d')- %s" % (sys.argv[2]))
+    dates = []
+    for date_str in [args.date, args.last_date or args.date]:
+        try:
+            dates.append(datetime.datetime.strptime(date_str, "%Y-%m-%d").date())
+        except:
+            print("Input string is not a correctly formatted date of form ('%Y-%m-%d')- %s" % (date_str))
+            raise SystemExit
+
+    # simulate every day from the first date up to and including the last date
+    first_date, last_date = dates[0], dates[-1]
+    dates = [first_date + datetime.timedelta(days=i) for i in range((last_date - first_date).days + 1)]
+    if len(dates) == 0:
+        print("The last date to simulate is before the first date - %s" % (last_date))
         raise SystemExit
 
     print(file_name)
 
-    all_transfers = parse_xfer_data_logs.parse_logs(file_name)
+    profiler = profiling.Profiler(args.profile) if args.profile is not None else None
+    with profiling.profiling(profiler):
+        with profiling.phase('total'):
+            simulate_log(args, file_name, dates)
+
+    if profiler is not None:
+        plots_folder = simulate.ensure_folder('plots-xfer_data_logs')
+        profile_filename = "{}/{}_{}_{}_profile.json".format(plots_folder, file_name[file_name.rfind('/')+1:],
+                                                             dates[0], dates[-1])
+        print("\nSaving profile to %s" % profile_filename)
+        profiler.save(profile_filename)
+
+
+# simulate the dates of the log the way the arguments ask for
+def simulate_log(args, file_name, dates):
+    first_date, last_date = dates[0], dates[-1]
+    interval_length = datetime.timedelta(seconds=args.interval_length)
+    heuristic_tups = [(heuristic_name, simulate.heuristics[heuristic_name]) for heuristic_name in args.heuristic]
+
+    if args.stream:
+        for heuristic_tup in heuristic_tups:
+            simulate.run_stream(file_name, interval_length, first_date, last_date, heuristic_tup, args.OD_percentage,
+                                args.network_capacity * 1024 * 1024, seed=args.seed, queue_order=args.queue_order,
+                                relative_accuracy=args.quantile_accuracy)
+        return
+
+    sites = None
+    if args.sites is not None:
+        sites = site_config.load_site_config(args.sites) if args.sites != '' else site_config.SiteConfig()
+
+    # parse the logs once and index them so every day only looks at the transfers that overlap it
+    with profiling.phase('parse'):
+        columns = parse_xfer_data_logs.load_log_columns(file_name)
+        if len(args.logs) > 0:
+            columns = parse_xfer_data_logs.concatenate_columns(
+                [columns] + [parse_xfer_data_logs.load_log_columns(log_file_name) for log_file_name in args.logs])
+        transfer_index = parse_xfer_data_logs.TransferIndex(columns)
 
-    transfers = get_transfers_on_day(all_transfers, date)
+    aggregate_lengths = [datetime.timedelta(seconds=seconds) for seconds in args.aggregate_lengths]
+    for aggregate_length in aggregate_lengths:
+        if aggregate_length <= datetime.timedelta(0) or aggregate_length % interval_length:
+            print("Aggregate lengths have to be multiples of the interval length - %s" % (aggregate_length))
+            raise SystemExit
 
-    interval_length = datetime.timedelta(minutes=1)
+    for date in dates:
+        # the sites are sharded from the transfer index, without making the transfers of the whole day
+        if sites is not None:
+            for heuristic_tup in heuristic_tups:
+                simulate.run_sites(transfer_index, interval_length, date, file_name, heuristic_tup, sites,
+                                   args.OD_percentage, engine=args.engine, workers=args.workers, seed=args.seed,
+                                   queue_order=args.queue_order, output_formats=args.save_output,
+                                   plot=not args.no_plot)
+            continue
 
-    # date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
-    plot_date_range = (date_time, date_time + datetime.timedelta(days=1))
+        with profiling.phase('transfers_on_day'):
+            transfers = transfer_index.transfers_on_day(date)
 
-    heuristic_tup = 'baseline', simulate.baseline_heuristic
+        date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
+        plot_date_range = (date_time, date_time + datetime.timedelta(days=1))
 
-    simulate.prepare_simulation(transfers, interval_length, date, plot_date_range, file_name, heuristic_tup)
+        if args.capacity_target is not None:
+            for heuristic_tup in heuristic_tups:
+                print('\n{} Heuristic - {} capacity search'.format(heuristic_tup[0], date))
+                simulate.find_capacity(transfers, interval_length, date, heuristic_tup, args.OD_percentage,
+                                       args.capacity_target, target_metric=args.target_metric,
+                                       percentile=args.target_percentile, engine=args.engine, workers=args.workers,
+                                       seed=args.seed if args.seed is not None else 0,
+                                       queue_order=args.queue_order)
+        elif args.replications is not None:
+            for heuristic_tup in heuristic_tups:
+                simulate.run_replications(transfers, interval_length, date, file_name, heuristic_tup, args.replications,
+                                          engine=args.engine, workers=args.workers, seed=args.seed,
+                                          queue_order=args.queue_order, confidence=args.confidence)
+        elif len(heuristic_tups) == 1:
+            simulate.prepare_simulation(transfers, interval_length, date, plot_date_range, file_name,
+                                        heuristic_tups[0], engine=args.engine, workers=args.workers,
+                                        seed=args.seed, queue_order=args.queue_order,
+                                        output_formats=args.save_output, plot=not args.no_plot,
+                                        plot_workers=args.plot_workers, aggregate_lengths=aggregate_lengths)
+        else:
+            simulate.compare_heuristics(transfers, interval_length, date, plot_date_range, file_name, heuristic_tups,
+                                        engine=args.engine, workers=args.workers, seed=args.seed,
+                                        queue_order=args.queue_order, output_formats=args.save_output,
+                                        plot=not args.no_plot, plot_workers=args.plot_workers,
+                                        aggregate_lengths=aggregate_lengths)
 
 
 # returns a list of all the transfers on the given day
@@ -55,7 +228,8 @@ def get_transfers_on_day(transfers, date):
 
     for transfer in transfers:
         # if transfer.start_time.date() == date or transfer.end_time.date() == date or
-        if transfer.requested_start_time.date() <= date <= transfer.requested_end_time.date():
+        if parse_xfer_data_logs.to_datetime(transfer.requested_start_time).date() <= date <= \
+                parse_xfer_data_logs.to_datetime(transfer.requested_end_time).date():
             transfers_on_day.append(transfer)
 
     # sort transfers by start_time
@@ -1,10 +1,29 @@
 import datetime
-import matplotlib as mpl
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import numpy
 import os
 
+from parse_xfer_data_logs import to_datetime
+import profiling
+
+
+# most points a line is drawn with, longer interval series are downsampled to it. At 250 dpi the default figure is
+# 1600 pixels wide, so this is a minimum and maximum for more than every pixel
+max_plot_points = 4000
+
+
+# matplotlib is only imported once something is plotted, so simulations that don't plot never load it. The plots
+# are only saved to files, so the non interactive Agg backend is used
+def load_pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.dates
+    import matplotlib.pyplot
+    return matplotlib, matplotlib.pyplot
+
 
 def plot_intervals(filename, title, intervals_list):
+    mpl, plt = load_pyplot()
 
     fig, ax = plt.subplots()
 
@@ -20,8 +39,7 @@ def plot_intervals(filename, title, intervals_list):
     line_counter = 0
 
     for idx, (label, intervals) in enumerate(intervals_list):
-        x = [interval.start_time for interval in intervals]
-        y = [interval.network_load()/bytes_in_MiB for interval in intervals]
+        x, y = downsample_min_max(intervals, intervals.network_loads() / bytes_in_MiB)
 
         plt.plot(x, y, color=colors[idx], linestyle='-', linewidth=0.5, label=label)
 
@@ -30,17 +48,19 @@ def plot_intervals(filename, title, intervals_list):
 
     # get the first set of intervals from the dictionary
     intervals = intervals_list[0][1]
+    start_time = to_datetime(intervals.start_time)
+    end_time = to_datetime(intervals.end_time)
 
     tick_freq = 3   # 1 x =_tick every 3 hours
-    num_ticks = int((intervals[-1].end_time - intervals[0].start_time).total_seconds() / (tick_freq * 3600))
-    x_tick_list = [intervals[0].start_time + datetime.timedelta(hours=i*tick_freq) for i in range(num_ticks+1)]
+    num_ticks = int((end_time - start_time).total_seconds() / (tick_freq * 3600))
+    x_tick_list = [start_time + datetime.timedelta(hours=i*tick_freq) for i in range(num_ticks+1)]
     ax.set_xticks(x_tick_list)
 
     ax.xaxis.set_minor_locator(mpl.dates.HourLocator())
     ax.xaxis.set_major_formatter(mpl.dates.DateFormatter('%H:%M'))
 
-    date_min = intervals[0].start_time - datetime.timedelta(hours=1)
-    date_max = intervals[-1].end_time + datetime.timedelta(hours=1)
+    date_min = start_time - datetime.timedelta(hours=1)
+    date_max = end_time + datetime.timedelta(hours=1)
     ax.set_xlim(date_min, date_max)
 
     fig.autofmt_xdate()
@@ -54,14 +74,65 @@ def plot_intervals(filename, title, intervals_list):
     plt.close(fig)
 
 
+# the start times (as datetime64) and values of the intervals to draw. Series longer than max_points are split into
+# max_points / 2 buckets of intervals and only the smallest and the largest value of each bucket is kept (in time
+# order), so every peak and dip still shows up in the plot
+def downsample_min_max(intervals, values, max_points=max_plot_points):
+    if len(values) <= max_points:
+        return intervals.start_times().astype('datetime64[us]'), values
+
+    bucket_size = -(-len(values) // (max_points // 2))
+    num_buckets = -(-len(values) // bucket_size)
+    # the last bucket is padded with the last value, picking a padded value is the same as picking the last one
+    padded = numpy.concatenate((values, numpy.full(num_buckets * bucket_size - len(values), values[-1])))
+    buckets = padded.reshape(num_buckets, bucket_size)
+
+    offsets = numpy.arange(num_buckets) * bucket_size
+    kept = numpy.unique(numpy.minimum(numpy.concatenate((offsets + buckets.argmin(axis=1),
+                                                         offsets + buckets.argmax(axis=1))), len(values) - 1))
+
+    return intervals.start_times()[kept].astype('datetime64[us]'), values[kept]
+
+
+# renders plots in worker processes, so whoever asks for a plot can go on while it is drawn. With 0 workers the plots
+# are rendered right away instead. Leaving the with block waits for all of the plots to be saved
+class PlotPool(object):
+    def __init__(self, workers=1):
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.futures = []
+
+    def plot_intervals(self, filename, title, intervals_list):
+        if self.executor is None:
+            with profiling.phase('plot_intervals'):
+                plot_intervals(filename, title, intervals_list)
+        else:
+            self.futures.append(self.executor.submit(plot_intervals, filename, title, intervals_list))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.executor is None:
+            return
+        try:
+            # raise the errors of the plots, if nothing else went wrong
+            with profiling.phase('wait_for_plots'):
+                for future in self.futures:
+                    if exc_type is None:
+                        future.result()
+        finally:
+            self.executor.shutdown()
+
+
 # make sure the plot filename is valid (i.e. all of the parent directories exist)
 def verify_filename(filename):
     for idx, cur_char in enumerate(filename):
-        if cur_char is '/':
+        if cur_char == '/' and idx > 0:
             cur_dir_path = filename[:idx]
 
+            # plots rendered at the same time can make the same directory
             if not os.path.exists(cur_dir_path):
-                os.makedirs(cur_dir_path)
+                os.makedirs(cur_dir_path, exist_ok=True)
 
 
 
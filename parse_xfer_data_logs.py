@@ -1,9 +1,14 @@
 
 import datetime
 from enum import Enum
+import numpy
 
+import hashlib
+import os
 from os.path import isfile
+import struct
 import sys
+import zlib
 
 
 column_evals = {
@@ -16,20 +21,32 @@ column_evals = {
 }
 
 
+# all of the times of a transfer are integer microseconds, since the epoch (TransferColumns.epoch) for points in time,
+# so the simulation never makes datetime objects. to_datetime and to_timedelta turn them back into datetimes
 class Transfer(object):
+    __slots__ = ('transfer_id', 'ip_address', 'trans_type', 'requested_start_time', 'requested_transfer_time',
+                 'requested_end_time', 'total_bytes', 'bytes_left', 'requested_rate', 'current_rate', 'start_time',
+                 'end_time', 'transfer_time')
+
     def __init__(self, transfer_id, ip_address, start_time, transfer_time, num_bytes, trans_type):
+        # the requested transfer, which never changes
         self.transfer_id = transfer_id
         self.ip_address = ip_address
-        self.trans_type = trans_type
 
         self.requested_start_time = start_time
         self.requested_transfer_time = transfer_time
         self.requested_end_time = start_time + transfer_time
 
         self.total_bytes = num_bytes
-        self.bytes_left = num_bytes
+        self.requested_rate = float(self.total_bytes) / (self.requested_transfer_time / microseconds_per_second)
 
-        self.requested_rate = float(self.total_bytes) / self.requested_transfer_time.total_seconds()
+        # the state of the transfer in a simulation
+        self.reset(trans_type)
+
+    # reset the simulation state so the transfer can be simulated again without copying it
+    def reset(self, trans_type):
+        self.trans_type = trans_type
+        self.bytes_left = self.total_bytes
         self.current_rate = self.requested_rate
 
         self.start_time = None
@@ -41,21 +58,21 @@ class Transfer(object):
             self.transfer_time = self.requested_transfer_time
         else:
             self.current_rate = rate
-            self.transfer_time = datetime.timedelta(seconds=(float(self.total_bytes) / self.current_rate))
+            self.transfer_time = round(float(self.total_bytes) / self.current_rate * microseconds_per_second)
 
         self.start_time = current_time
         self.end_time = self.start_time + self.transfer_time
 
     def update_rate(self, rate, current_time):
         self.current_rate = rate
-        self.end_time = current_time + datetime.timedelta(seconds=(float(self.bytes_left) / self.current_rate))
+        self.end_time = current_time + round(float(self.bytes_left) / self.current_rate * microseconds_per_second)
         self.transfer_time = self.end_time - self.start_time
 
     def bytes_transferred_during_interval(self, interval):
         # figure out how the transfer intersects with interval
         start_t = max(self.start_time, interval.start_time)
         end_t = min(self.end_time, interval.end_time)
-        bytes_transferred = (end_t - start_t).total_seconds() * self.current_rate
+        bytes_transferred = (end_t - start_t) / microseconds_per_second * self.current_rate
         return bytes_transferred
 
     def update_bytes_for_interval(self, interval):
@@ -64,11 +81,12 @@ class Transfer(object):
     def __repr__(self):
         if self.start_time is not None:
             return "( Requested Time {} - {} | Actual Time {} - {} | {} Total Bytes | {} Bytes Remaining )".\
-                format(self.requested_start_time, self.requested_end_time,
-                       self.start_time, self.end_time, self.total_bytes, self.bytes_left)
+                format(to_datetime(self.requested_start_time), to_datetime(self.requested_end_time),
+                       to_datetime(self.start_time), to_datetime(self.end_time), self.total_bytes, self.bytes_left)
         else:
             return "( Requested Time {} - {} | {} Total Bytes | {} Bytes Remaining )". \
-                format(self.requested_start_time, self.requested_end_time, self.total_bytes, self.bytes_left)
+                format(to_datetime(self.requested_start_time), to_datetime(self.requested_end_time),
+                       self.total_bytes, self.bytes_left)
 
 
 class TransferType(Enum):
@@ -77,6 +95,11 @@ class TransferType(Enum):
 
 
 def parse_logs(file_name):
+    return load_log_columns(file_name).transfers()
+
+
+# the original eval based parser, kept as the reference the columnar parser is checked against
+def parse_logs_eval(file_name):
     if not isfile(file_name):
         print("ERROR - Provided file_name for xfer log file is not valid: '{}'".format(file_name))
         sys.exit(1)
@@ -122,8 +145,8 @@ def parse_logs(file_name):
                 row['end_time'] = row['start_time'] + row['transfer_time']
                 # row['rate'] = float(row['num_bytes']) / row['transfer_time'].total_seconds()
 
-                new_transfer = Transfer(row['id'], row['ip_address'], row['start_time'], row['transfer_time'],
-                                        row['num_bytes'], row['trans_type'])
+                new_transfer = Transfer(row['id'], row['ip_address'], to_microseconds(row['start_time']),
+                                        to_microseconds(row['transfer_time']), row['num_bytes'], row['trans_type'])
                 transfers.append(new_transfer)
 
             except Exception:
@@ -139,3 +162,380 @@ def parse_logs(file_name):
                     bad_rows += 1
 
     return transfers
+
+
+# the columns of a parsed xfer log. Times are stored as microseconds since the epoch (start_times) and microseconds
+# (transfer_times) so the whole log can be kept in numpy arrays, Transfer objects are only made when asked for
+class TransferColumns(object):
+    epoch = datetime.datetime(1970, 1, 1)
+
+    def __init__(self, ids, ip_addresses, start_times, transfer_times, num_bytes, trans_types):
+        self.ids = ids
+        self.ip_addresses = ip_addresses
+        self.start_times = start_times
+        self.transfer_times = transfer_times
+        self.num_bytes = num_bytes
+        self.trans_types = trans_types
+
+    def __len__(self):
+        return len(self.ids)
+
+    def transfer(self, idx):
+        return Transfer(int(self.ids[idx]), str(self.ip_addresses[idx]), int(self.start_times[idx]),
+                        int(self.transfer_times[idx]), int(self.num_bytes[idx]), int(self.trans_types[idx]))
+
+    # make Transfer objects for all of the rows, or only for the rows selected by indices (or a boolean mask)
+    def iter_transfers(self, indices=None):
+        if indices is None:
+            indices = numpy.arange(len(self))
+        elif getattr(indices, 'dtype', None) == bool:
+            indices = numpy.flatnonzero(indices)
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+
+        # convert the columns in chunks so the numpy values are turned into python values in bulk
+        chunk_size = 65536
+        for chunk_start in range(0, len(indices), chunk_size):
+            chunk = indices[chunk_start:chunk_start + chunk_size]
+            rows = zip(self.ids[chunk].tolist(), self.ip_addresses[chunk].tolist(),
+                       self.start_times[chunk].tolist(), self.transfer_times[chunk].tolist(),
+                       self.num_bytes[chunk].tolist(), self.trans_types[chunk].tolist())
+
+            for transfer_id, ip_address, start_time, transfer_time, num_bytes, trans_type in rows:
+                yield Transfer(transfer_id, str(ip_address), start_time, transfer_time, num_bytes, trans_type)
+
+    def transfers(self, indices=None):
+        return list(self.iter_transfers(indices))
+
+    # the columns of only the rows selected by indices (or a boolean mask)
+    def take(self, indices):
+        return TransferColumns(self.ids[indices], self.ip_addresses[indices], self.start_times[indices],
+                               self.transfer_times[indices], self.num_bytes[indices], self.trans_types[indices])
+
+
+# index over the transfers of a log sorted by their requested start time, answering which transfers overlap a day or
+# any other window with binary searches instead of scanning every transfer
+class TransferIndex(object):
+    def __init__(self, columns):
+        self.columns = columns
+        self.order = numpy.argsort(columns.start_times, kind='stable')
+        self.start_times = numpy.asarray(columns.start_times)[self.order]
+        self.end_times = self.start_times + numpy.asarray(columns.transfer_times)[self.order]
+        # the latest end time of all of the transfers that start before each transfer (and the transfer itself)
+        self.max_end_times = numpy.maximum.accumulate(self.end_times) if len(self.order) > 0 else self.end_times
+
+    # the indices into columns of the transfers requested to run during [start_time, end_time), by requested start
+    def indices_in_window(self, start_time, end_time):
+        start_time = to_microseconds(start_time)
+        end_time = to_microseconds(end_time)
+
+        # transfers before first_idx all end before start_time, transfers after last_idx all start after end_time
+        first_idx = numpy.searchsorted(self.max_end_times, start_time, side='left')
+        last_idx = numpy.searchsorted(self.start_times, end_time, side='left')
+
+        candidates = numpy.arange(first_idx, max(first_idx, last_idx))
+        candidates = candidates[self.end_times[candidates] >= start_time]
+        return self.order[candidates]
+
+    def transfers_in_window(self, start_time, end_time):
+        return self.columns.transfers(self.indices_in_window(start_time, end_time))
+
+    # same transfers as main.get_transfers_on_day, the ones requested to start on or before the day and end on or
+    # after it
+    def transfers_on_day(self, date):
+        date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
+        return self.transfers_in_window(date_time, date_time + datetime.timedelta(days=1))
+
+
+microseconds_per_second = 1000000
+
+
+# microseconds since the epoch of a datetime, or microseconds of a timedelta
+def to_microseconds(time):
+    if isinstance(time, datetime.timedelta):
+        return time // datetime.timedelta(microseconds=1)
+    return (time - TransferColumns.epoch) // datetime.timedelta(microseconds=1)
+
+
+def to_datetime(microseconds):
+    return TransferColumns.epoch + datetime.timedelta(microseconds=microseconds)
+
+
+def to_timedelta(microseconds):
+    return datetime.timedelta(microseconds=microseconds)
+
+
+# the rows of several TransferColumns as one, e.g. to simulate the transfers of several logs together
+def concatenate_columns(columns_list):
+    return TransferColumns(numpy.concatenate([columns.ids for columns in columns_list]),
+                           numpy.concatenate([columns.ip_addresses for columns in columns_list]),
+                           numpy.concatenate([columns.start_times for columns in columns_list]),
+                           numpy.concatenate([columns.transfer_times for columns in columns_list]),
+                           numpy.concatenate([columns.num_bytes for columns in columns_list]),
+                           numpy.concatenate([columns.trans_types for columns in columns_list]))
+
+
+# the columns of already made transfers, e.g. to send them to other processes
+def transfers_to_columns(transfers):
+    return TransferColumns(numpy.array([transfer.transfer_id for transfer in transfers], dtype=numpy.int64),
+                           numpy.array([transfer.ip_address for transfer in transfers], dtype=object),
+                           numpy.array([transfer.requested_start_time for transfer in transfers], dtype=numpy.int64),
+                           numpy.array([transfer.requested_transfer_time for transfer in transfers],
+                                       dtype=numpy.int64),
+                           numpy.array([transfer.total_bytes for transfer in transfers], dtype=numpy.int64),
+                           numpy.array([getattr(transfer.trans_type, 'value', transfer.trans_type)
+                                        for transfer in transfers], dtype=numpy.int8))
+
+
+def parse_log_columns(file_name):
+    columns = [[] for _ in column_parsers]
+    for row in iter_log_rows(file_name):
+        for column, value in zip(columns, row):
+            column.append(value)
+    columns = dict(zip(column_parsers, columns))
+
+    return TransferColumns(numpy.array(columns['id'], dtype=numpy.int64),
+                           numpy.array(columns['ip_address'], dtype=object),
+                           numpy.array(columns['start_time'], dtype=numpy.int64),
+                           numpy.array(columns['transfer_time'], dtype=numpy.int64),
+                           numpy.array(columns['num_bytes'], dtype=numpy.int64),
+                           numpy.array(columns['trans_type'], dtype=numpy.int8))
+
+
+# make a Transfer for every row of the log as it is read, without keeping the log in memory
+def iter_log_transfers(file_name):
+    for transfer_id, ip_address, start_time, transfer_time, trans_type, num_bytes in iter_log_rows(file_name):
+        yield Transfer(transfer_id, ip_address, start_time, transfer_time, num_bytes, trans_type)
+
+
+# read the rows of a log one at a time, each row is a list of the values of the columns in column_parsers order.
+# Rows that can't be parsed are printed and skipped
+def iter_log_rows(file_name):
+    if not isfile(file_name):
+        print("ERROR - Provided file_name for xfer log file is not valid: '{}'".format(file_name))
+        sys.exit(1)
+    with open(file_name, 'r') as file_in:
+
+        # read headers from the first row
+        first_line = file_in.readline()
+        column_headers = [val.strip() for val in first_line.split('|')]
+
+        # make sure all of the necessary headers are there so parsing will work
+        for key in column_parsers:
+            if key not in column_headers:
+                print("ERROR - Provided xfer log file does not contain all of the necessary columns")
+                print("'{}' does not contain column '{}'".format(file_name, key))
+                sys.exit(1)
+
+        column_idx = [(column_headers.index(key), key, parser) for key, parser in column_parsers.items()]
+        num_columns = max(idx for idx, _, _ in column_idx) + 1
+
+        bad_rows = 0
+
+        for line in file_in:
+            line = line.strip()
+            line_values = line.split('|')
+
+            if line.strip('-+| ') == '':
+                print('skipped line: {}'.format(line))
+                continue
+
+            # if the line is the last line '(123 rows)', don't print error message
+            if len(line_values) == 1 and line.find('rows)') != -1:
+                print('{} in log file - {} bad rows'.format(line.strip('()'), bad_rows))
+                continue
+
+            if len(line_values) < num_columns:
+                print("Could not parse column {} ('{}') in this row:".format(column_headers[len(line_values)], ''))
+                print(line)
+                bad_rows += 1
+                continue
+
+            row = []
+            for idx, key, parser in column_idx:
+                value = line_values[idx].strip()
+                try:
+                    row.append(parser(value))
+                except ValueError:
+                    print("Could not parse column {} ('{}') in this row:".format(key, value))
+                    print(line)
+                    bad_rows += 1
+                    break
+            else:
+                yield row
+
+
+def parse_int(value):
+    if value == 'NULL':
+        raise ValueError(value)
+    return int(value)
+
+
+def parse_str(value):
+    if value == '' or value == 'NULL':
+        raise ValueError(value)
+    return value
+
+
+# microseconds since the epoch of the day in a 'YYYY-MM-DD' string, cached since a log only spans a few days
+day_microseconds = {}
+
+
+# decode a '%Y-%m-%d %H:%M:%S.%f' timestamp into microseconds since the epoch
+def parse_timestamp(value):
+    day = value[:10]
+    if day not in day_microseconds:
+        if len(day) != 10 or day[4] != '-' or day[7] != '-':
+            raise ValueError(value)
+        date = datetime.date(int(day[:4]), int(day[5:7]), int(day[8:10]))
+        day_microseconds[day] = (date - TransferColumns.epoch.date()).days * 86400000000
+
+    if value[10:11] != ' ':
+        raise ValueError(value)
+    return day_microseconds[day] + parse_time(value[11:])
+
+
+# decode a '%H:%M:%S.%f' time into microseconds
+def parse_time(value):
+    hours, minutes, seconds = value.split(':')
+    seconds, _, fraction = seconds.partition('.')
+    if len(hours) > 2 or len(minutes) > 2 or len(seconds) > 2 or not 0 < len(fraction) <= 6:
+        raise ValueError(value)
+
+    hours, minutes, seconds = int(hours), int(minutes), int(seconds)
+    if not (0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 60):
+        raise ValueError(value)
+
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000000 + int(fraction.ljust(6, '0'))
+
+
+# transfers have to take some time for them to have a rate
+def parse_transfer_time(value):
+    transfer_time = parse_time(value)
+    if transfer_time <= 0:
+        raise ValueError(value)
+    return transfer_time
+
+
+column_parsers = {
+    'id': parse_int,
+    'ip_address': parse_str,
+    'start_time': parse_timestamp,
+    'transfer_time': parse_transfer_time,
+    'trans_type': parse_int,
+    'num_bytes': parse_int
+}
+
+
+# binary cache of a parsed xfer log, written next to the log as '<log>.cache'. The header records the size, mtime and
+# a hash of the log it was made from plus a checksum of the data, the data is the TransferColumns arrays one after
+# another so they can be memory mapped, followed by the table of unique ip addresses
+cache_magic = b'XFERCACH'
+cache_version = 1
+cache_header = struct.Struct('<8sIqq32sQQI')
+cache_header_size = 128
+cache_columns = [('ids', numpy.int64), ('start_times', numpy.int64), ('transfer_times', numpy.int64),
+                 ('num_bytes', numpy.int64), ('ip_codes', numpy.int32), ('trans_types', numpy.int8)]
+# number of bytes from the start and end of the log that are hashed
+cache_hash_bytes = 1024 * 1024
+
+
+# load the log from its cache, parsing it and (re)writing the cache if it is missing, stale or corrupt
+def load_log_columns(file_name, use_cache=True):
+    if not use_cache:
+        return parse_log_columns(file_name)
+
+    # the key is taken before the log is parsed, so a log that changes while it is parsed leaves a cache that is stale
+    # for its new contents rather than one that looks up to date
+    cache_name = file_name + '.cache'
+    key = log_cache_key(file_name)
+    if isfile(cache_name):
+        try:
+            return read_log_cache(cache_name, key)
+        except (OSError, ValueError, struct.error) as error:
+            print("Rebuilding cache '{}' - {}".format(cache_name, error))
+
+    columns = parse_log_columns(file_name)
+    try:
+        write_log_cache(cache_name, key, columns)
+    except OSError as error:
+        print("Could not write cache '{}' - {}".format(cache_name, error))
+    return columns
+
+
+# the size, mtime and a hash of the start and end of the log file
+def log_cache_key(file_name):
+    stat = os.stat(file_name)
+    file_hash = hashlib.blake2b(digest_size=32)
+    with open(file_name, 'rb') as file_in:
+        file_hash.update(file_in.read(cache_hash_bytes))
+        if stat.st_size > cache_hash_bytes:
+            file_in.seek(max(stat.st_size - cache_hash_bytes, cache_hash_bytes))
+            file_hash.update(file_in.read())
+    return stat.st_size, stat.st_mtime_ns, file_hash.digest()
+
+
+def write_log_cache(cache_name, key, columns):
+    ip_table, ip_codes = numpy.unique(numpy.asarray(columns.ip_addresses, dtype=str), return_inverse=True)
+    ip_table = '\n'.join(ip_table.tolist()).encode('utf-8')
+
+    arrays = {'ids': columns.ids, 'start_times': columns.start_times, 'transfer_times': columns.transfer_times,
+              'num_bytes': columns.num_bytes, 'ip_codes': ip_codes.ravel(), 'trans_types': columns.trans_types}
+    data = [numpy.ascontiguousarray(arrays[name], dtype=dtype).tobytes() for name, dtype in cache_columns]
+    data.append(ip_table)
+
+    checksum = 0
+    for chunk in data:
+        checksum = zlib.crc32(chunk, checksum)
+
+    header = cache_header.pack(cache_magic, cache_version, key[0], key[1], key[2], len(columns), len(ip_table),
+                               checksum)
+
+    # write to a temporary file first so an interrupted write never leaves a half written cache behind
+    tmp_name = '{}.{}.tmp'.format(cache_name, os.getpid())
+    try:
+        with open(tmp_name, 'wb') as file_out:
+            file_out.write(header.ljust(cache_header_size, b'\0'))
+            for chunk in data:
+                file_out.write(chunk)
+        os.replace(tmp_name, cache_name)
+    finally:
+        if isfile(tmp_name):
+            os.remove(tmp_name)
+
+
+def read_log_cache(cache_name, key):
+    with open(cache_name, 'rb') as file_in:
+        header = file_in.read(cache_header_size)
+    if len(header) != cache_header_size:
+        raise ValueError('truncated header')
+
+    magic, version, log_size, log_mtime, log_hash, num_rows, ip_table_size, checksum = \
+        cache_header.unpack_from(header)
+    if magic != cache_magic or version != cache_version:
+        raise ValueError('unknown format')
+    if (log_size, log_mtime, log_hash) != key:
+        raise ValueError('log file has changed')
+
+    data_size = num_rows * sum(numpy.dtype(dtype).itemsize for _, dtype in cache_columns) + ip_table_size
+    if os.path.getsize(cache_name) != cache_header_size + data_size:
+        raise ValueError('wrong size')
+
+    if data_size == 0:
+        data = numpy.zeros(0, dtype=numpy.uint8)
+    else:
+        data = numpy.memmap(cache_name, dtype=numpy.uint8, mode='r', offset=cache_header_size, shape=(data_size,))
+    if zlib.crc32(data) != checksum:
+        raise ValueError('checksum mismatch')
+
+    arrays = {}
+    offset = 0
+    for name, dtype in cache_columns:
+        size = num_rows * numpy.dtype(dtype).itemsize
+        arrays[name] = data[offset:offset + size].view(dtype)
+        offset += size
+
+    ip_table = bytes(data[offset:]).decode('utf-8')
+    ip_table = numpy.array(ip_table.split('\n') if ip_table_size > 0 else [], dtype=object)
+
+    return TransferColumns(arrays['ids'], ip_table[arrays['ip_codes']], arrays['start_times'],
+                           arrays['transfer_times'], arrays['num_bytes'], arrays['trans_types'])
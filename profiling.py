@@ -0,0 +1,172 @@
+import cProfile
+import json
+import pstats
+import time
+import tracemalloc
+
+
+# what a Profiler can capture for every scenario on top of its timers and counters: the calls of the scenario
+# (cProfile) and the memory it allocated (tracemalloc). Both slow the scenarios down a lot
+capture_options = ['cprofile', 'tracemalloc']
+
+# number of functions and allocation sites kept of every capture
+top_entries = 25
+
+
+# the Profiler the instrumented code reports to, None when nothing is profiled. The instrumented functions read it
+# once and skip their instrumentation without one, so profiling costs next to nothing when it is off
+active_profiler = None
+
+
+# wall clock and CPU timers of the phases of a run, counters and observations of values (e.g. queue depths).
+# Scenarios are profiled by Profilers of their own (so scenarios run in worker processes can send their reports
+# back) whose reports are added to the report of the run under their scenario names
+class Profiler(object):
+    def __init__(self, capture=()):
+        for capture_option in capture:
+            if capture_option not in capture_options:
+                raise ValueError('Can not capture {}'.format(capture_option))
+
+        self.capture = list(capture)
+        # name: [calls, wall seconds, cpu seconds], the cpu seconds are None for the phases that are only timed by the
+        # wall clock because they are timed too often to also read the cpu time
+        self.phases = {}
+        self.counters = {}
+        # name: [count, total, max]
+        self.observations = {}
+        self.scenarios = {}
+        self.captures = {}
+
+    def add_time(self, name, wall, cpu=None):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = [0, 0.0, cpu]
+        elif cpu is not None:
+            phase[2] += cpu
+        phase[0] += 1
+        phase[1] += wall
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        observation = self.observations.get(name)
+        if observation is None:
+            self.observations[name] = [1, value, value]
+        else:
+            observation[0] += 1
+            observation[1] += value
+            if value > observation[2]:
+                observation[2] = value
+
+    def add_scenario(self, name, report):
+        self.scenarios[name] = report
+
+    def report(self):
+        report = {
+            'phases': {name: {'calls': calls, 'wall_seconds': wall, 'cpu_seconds': cpu}
+                       for name, (calls, wall, cpu) in sorted(self.phases.items(), key=lambda item: -item[1][1])},
+            'counters': dict(sorted(self.counters.items())),
+            'observations': {name: {'count': num_values, 'mean': total / num_values, 'max': most}
+                             for name, (num_values, total, most) in sorted(self.observations.items())},
+        }
+        report.update(self.captures)
+        if len(self.scenarios) > 0:
+            report['scenarios'] = self.scenarios
+        return report
+
+    def save(self, file_name):
+        with open(file_name, 'w') as file_out:
+            json.dump(self.report(), file_out, indent=2)
+
+
+# times a phase of the active profiler while it is in a with block, the Profiler is looked up when the block starts
+class Phase(object):
+    def __init__(self, name):
+        self.name = name
+        self.profiler = None
+        self.wall_start = None
+        self.cpu_start = None
+
+    def __enter__(self):
+        self.profiler = active_profiler
+        if self.profiler is not None:
+            self.wall_start = time.perf_counter()
+            self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profiler is not None:
+            self.profiler.add_time(self.name, time.perf_counter() - self.wall_start,
+                                   time.process_time() - self.cpu_start)
+
+
+def phase(name):
+    return Phase(name)
+
+
+# makes a Profiler the active one in a with block (None turns profiling off in it). With capture, the cProfile calls
+# and tracemalloc allocations of the block are added to the Profiler's report for each of the Profiler's capture
+# options. Only one block can capture at a time, which are the scenarios
+class Profiling(object):
+    def __init__(self, profiler, capture=False):
+        self.profiler = profiler
+        self.capture = capture and profiler is not None
+        self.previous_profiler = None
+        self.call_profile = None
+
+    def __enter__(self):
+        global active_profiler
+        self.previous_profiler = active_profiler
+        active_profiler = self.profiler
+
+        if self.capture:
+            if 'tracemalloc' in self.profiler.capture and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if 'cprofile' in self.profiler.capture:
+                self.call_profile = cProfile.Profile()
+                self.call_profile.enable()
+        return self.profiler
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global active_profiler
+        active_profiler = self.previous_profiler
+
+        if self.call_profile is not None:
+            self.call_profile.disable()
+            self.profiler.captures['cprofile'] = call_profile_report(self.call_profile)
+        if self.capture and 'tracemalloc' in self.profiler.capture and tracemalloc.is_tracing():
+            self.profiler.captures['tracemalloc'] = tracemalloc_report(tracemalloc.take_snapshot(),
+                                                                      tracemalloc.get_traced_memory())
+            tracemalloc.stop()
+
+
+def profiling(profiler, capture=False):
+    return Profiling(profiler, capture)
+
+
+# the capture options of the scenarios of the active profiler, None when nothing is profiled
+def scenario_capture():
+    return None if active_profiler is None else active_profiler.capture
+
+
+# the functions the most time was spent in (including the functions they called)
+def call_profile_report(call_profile):
+    stats = pstats.Stats(call_profile)
+    functions = []
+    for (file_name, line_number, function_name), (_, calls, total, cumulative, _) in stats.stats.items():
+        functions.append({'function': '{}:{}({})'.format(file_name, line_number, function_name), 'calls': calls,
+                          'total_seconds': total, 'cumulative_seconds': cumulative})
+    functions.sort(key=lambda function: -function['cumulative_seconds'])
+    return functions[:top_entries]
+
+
+# the peak of the traced memory and the lines that allocated the most of the memory still in use
+def tracemalloc_report(snapshot, traced_memory):
+    current, peak = traced_memory
+    return {
+        'current_bytes': current,
+        'peak_bytes': peak,
+        'top_allocations': [{'line': str(statistic.traceback), 'bytes': statistic.size, 'count': statistic.count}
+                            for statistic in snapshot.statistics('lineno')[:top_entries]],
+    }
@@ -0,0 +1,58 @@
+import numpy
+
+from parse_xfer_data_logs import microseconds_per_second
+
+
+# arbitrarily set minimum rate to 100 bytes/sec, transfers always need some rate to have an end time
+minimum_rate = 100
+
+
+# max-min fair (water filling) allocation of capacity between transfers asking for demands. Transfers asking for less
+# than their share get what they ask for and the capacity they leave is split between the rest in proportion to their
+# weights. Every transfer gets at least min_rate
+def max_min_fair_rates(demands, capacity, weights=None, min_rate=minimum_rate):
+    demands = numpy.asarray(demands, dtype=numpy.float64)
+    if weights is None:
+        weights = numpy.ones(len(demands))
+    weights = numpy.asarray(weights, dtype=numpy.float64)
+
+    if len(demands) == 0 or demands.sum() <= capacity:
+        return numpy.maximum(demands, min_rate)
+
+    # transfers are satisfied in the order of their demand per weight. If the first k are satisfied, the rest get
+    # level * weight with level = (capacity - sum of the first k demands) / sum of the rest of the weights
+    order = numpy.argsort(demands / weights, kind='stable')
+    sorted_demands = demands[order]
+    sorted_weights = weights[order]
+
+    satisfied_demands = numpy.concatenate(([0.0], numpy.cumsum(sorted_demands)[:-1]))
+    remaining_weights = numpy.cumsum(sorted_weights[::-1])[::-1]
+    levels = (capacity - satisfied_demands) / remaining_weights
+
+    # the first transfer that can't be satisfied at the level made from the transfers before it sets the level
+    unsatisfied = levels * sorted_weights < sorted_demands
+    level = max(levels[numpy.argmax(unsatisfied)], 0.0)
+
+    rates = numpy.minimum(demands, level * weights)
+    return numpy.maximum(rates, min_rate)
+
+
+# share what is left of 0.95 * network_capacity after the OD transfers of the interval between its BE transfers,
+# up to their requested rates. Only transfers whose rate changes are updated, from the start of the interval
+def allocate_BE_rates(current_interval, network_capacity, weights=None):
+    BE_transfers = current_interval.BE_transfers
+    if len(BE_transfers) == 0:
+        return
+
+    OD_load = current_interval.OD_bytes / (current_interval.length / microseconds_per_second)
+    demands = [transfer.requested_rate for transfer in BE_transfers]
+    rates = max_min_fair_rates(demands, 0.95 * network_capacity - OD_load, weights)
+
+    changed = False
+    for transfer, rate in zip(BE_transfers, rates.tolist()):
+        if rate != transfer.current_rate:
+            transfer.update_rate(rate, current_interval.start_time)
+            changed = True
+
+    if changed:
+        current_interval.update_BE_network_load()
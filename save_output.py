@@ -0,0 +1,166 @@
+import numpy
+
+from parse_xfer_data_logs import microseconds_per_second
+import transfer_metrics
+
+
+# formats the interval series and transfer outcomes can be saved in. npz keeps the columns as numpy arrays
+# (numpy.load(file_name)[column_name]), csv writes the same columns as text
+output_formats = ['npz', 'csv']
+
+# number of rows the streaming writers buffer before writing them
+default_chunk_size = 65536
+
+
+# the columns of an IntervalSeries, the length is in seconds and the bytes and network_load are split into OD and BE
+def interval_columns(intervals):
+    return make_interval_columns(intervals.start_times(), intervals.length, intervals.OD_bytes, intervals.BE_bytes,
+                                 intervals.OD_counts, intervals.BE_counts)
+
+
+# the interval columns from arrays of the start times (microseconds), bytes and transfer counts of intervals that all
+# have the given length (microseconds)
+def make_interval_columns(start_times, length, OD_bytes, BE_bytes, OD_counts, BE_counts):
+    num_bytes = OD_bytes + BE_bytes
+
+    return {
+        'start_time': start_times.astype('datetime64[us]'),
+        'end_time': (start_times + length).astype('datetime64[us]'),
+        'length': numpy.full(len(start_times), length / microseconds_per_second),
+        'bytes': num_bytes,
+        'OD_transfers': OD_counts,
+        'BE_transfers': BE_counts,
+        'OD_bytes': OD_bytes,
+        'BE_bytes': BE_bytes,
+        'network_load': num_bytes / (length / microseconds_per_second),
+    }
+
+
+# save the intervals to file_name with the extension of each format
+def save_intervals(file_name, intervals, formats):
+    return save_columns(file_name, interval_columns(intervals), formats)
+
+
+# save the transfers recorded in a TransferMetrics and their outcomes to file_name with the extension of each format
+def save_transfer_outcomes(file_name, metrics, formats):
+    return save_columns(file_name, metrics.columns(), formats)
+
+
+# returns the names of the files written
+def save_columns(file_name, columns, formats):
+    file_names = []
+    for output_format in formats:
+        output_file_name = '{}.{}'.format(file_name, output_format)
+        column_writers[output_format](output_file_name, columns)
+        file_names.append(output_file_name)
+    return file_names
+
+
+def write_npz(file_name, columns):
+    numpy.savez(file_name, **columns)
+
+
+def write_csv(file_name, columns):
+    with open(file_name, 'w') as file_out:
+        file_out.write(', '.join(columns) + '\n')
+        write_csv_rows(file_out, columns)
+
+
+# every column is turned into strings at once by numpy and the strings are only joined into lines, so no value is
+# formatted on its own
+def write_csv_rows(file_out, columns):
+    string_columns = []
+    for column in columns.values():
+        if numpy.issubdtype(column.dtype, numpy.datetime64):
+            strings = numpy.char.replace(numpy.datetime_as_string(column, unit='us'), 'T', ' ')
+        else:
+            strings = column.astype(str)
+        string_columns.append(strings.tolist())
+
+    for line in map(', '.join, zip(*string_columns)):
+        file_out.write(line + '\n')
+
+
+column_writers = {
+    'npz': write_npz,
+    'csv': write_csv,
+}
+
+
+# writes rows to a csv file while a simulation is still running, with the same columns as write_csv. The rows are
+# buffered and written chunk_size at a time, so only one chunk is held in memory. Subclasses record the rows and
+# return the buffered rows as columns from columns() and empty the buffer in clear()
+class ChunkedCsvWriter(object):
+    def __init__(self, file_name, chunk_size=default_chunk_size):
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.clear()
+
+        self.file_out = open(file_name, 'w')
+        self.file_out.write(', '.join(self.columns()) + '\n')
+
+    def flush(self):
+        if len(self) > 0:
+            write_csv_rows(self.file_out, self.columns())
+            self.clear()
+
+    def close(self):
+        self.flush()
+        self.file_out.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# saves the intervals of a simulation as they are done (e.g. the ones simulate.step_intervals yields), which all have
+# to be interval_length (microseconds) long
+class IntervalCsvWriter(ChunkedCsvWriter):
+    def __init__(self, file_name, interval_length, chunk_size=default_chunk_size):
+        self.length = interval_length
+        super(IntervalCsvWriter, self).__init__(file_name, chunk_size)
+
+    def clear(self):
+        self.start_times = []
+        self.OD_bytes = []
+        self.BE_bytes = []
+        self.OD_counts = []
+        self.BE_counts = []
+
+    def __len__(self):
+        return len(self.start_times)
+
+    def record(self, interval):
+        self.start_times.append(interval.start_time)
+        self.OD_bytes.append(interval.OD_bytes)
+        self.BE_bytes.append(interval.BE_bytes)
+        self.OD_counts.append(interval.OD_count)
+        self.BE_counts.append(interval.BE_count)
+        if len(self) >= self.chunk_size:
+            self.flush()
+
+    def columns(self):
+        return make_interval_columns(numpy.array(self.start_times, dtype=numpy.int64), self.length,
+                                     numpy.array(self.OD_bytes, dtype=float), numpy.array(self.BE_bytes, dtype=float),
+                                     numpy.array(self.OD_counts, dtype=numpy.int64),
+                                     numpy.array(self.BE_counts, dtype=numpy.int64))
+
+
+# saves the transfers and their outcomes as they finish, like a TransferMetrics that is written to file_name every
+# chunk_size transfers
+class TransferCsvWriter(ChunkedCsvWriter):
+    def clear(self):
+        self.metrics = transfer_metrics.TransferMetrics()
+
+    def __len__(self):
+        return len(self.metrics)
+
+    def record(self, transfer):
+        self.metrics.record(transfer)
+        if len(self) >= self.chunk_size:
+            self.flush()
+
+    def columns(self):
+        return self.metrics.columns()
@@ -1,18 +1,33 @@
 import datetime
+import heapq
+from collections import deque
+from itertools import chain, count
 from operator import attrgetter
+from time import perf_counter
 import numpy
 
-from parse_xfer_data_logs import TransferType
-import copy
+import parse_xfer_data_logs
+from parse_xfer_data_logs import TransferType, microseconds_per_second, to_datetime, to_microseconds, to_timedelta
+import math
 import random
+from concurrent.futures import ProcessPoolExecutor
 
 from os.path import exists
 from os import makedirs
 
+import interval_statistics
 import make_plot
+import profiling
+import rate_allocation
+import save_output
+import transfer_metrics
 
 
+# like Transfer, the start_time, length and end_time of an interval are integer microseconds
 class Interval(object):
+    __slots__ = ('start_time', 'length', 'end_time', 'bytes', 'OD_transfers', 'BE_transfers', 'OD_bytes', 'BE_bytes',
+                 'OD_count', 'BE_count')
+
     def __init__(self, start_time, interval_length):
         self.start_time = start_time
         self.length = interval_length
@@ -24,15 +39,19 @@ class Interval(object):
         self.BE_transfers = []
         self.OD_bytes = 0
         self.BE_bytes = 0
+        self.OD_count = 0
+        self.BE_count = 0
 
     def add_transfer(self, transfer):
         # add the transfer to the correct transfer list for the interval and
         # increase the interval's bytes by the number of bytes the transfer transfers during the interval
         if transfer.trans_type is TransferType.BE:
             self.BE_transfers.append(transfer)
+            self.BE_count += 1
             self.BE_bytes += transfer.bytes_transferred_during_interval(self)
         elif transfer.trans_type is TransferType.OD:
             self.OD_transfers.append(transfer)
+            self.OD_count += 1
             self.OD_bytes += transfer.bytes_transferred_during_interval(self)
 
         # self.bytes += transfer.update_bytes(self)
@@ -50,143 +69,852 @@ class Interval(object):
             self.BE_bytes += transfer.bytes_transferred_during_interval(self)
 
     def network_load(self):
-        return float(self.OD_bytes + self.BE_bytes) / self.length.total_seconds()
+        return float(self.OD_bytes + self.BE_bytes) / (self.length / microseconds_per_second)
         # return self.bytes / self.length.total_seconds()
 
     def log_header(self):
         return 'start_time, end_time, length, bytes, # OD_transfers, # BE_transfers\n'
 
     def save_to_log(self):
-        return '{}, {}, {}, {}, {}, {}\n'.format(self.start_time, self.end_time, self.length, self.bytes,
-                                                 len(self.OD_transfers), len(self.BE_transfers))
+        return '{}, {}, {}, {}, {}, {}\n'.format(to_datetime(self.start_time), to_datetime(self.end_time),
+                                                 to_timedelta(self.length), self.bytes, self.OD_count, self.BE_count)
 
     def __repr__(self):
-        return "(start_t: {}, end_t: {}, bytes: {})".format(self.start_time, self.end_time, self.bytes)
+        return "(start_t: {}, end_t: {}, bytes: {})".format(to_datetime(self.start_time), to_datetime(self.end_time),
+                                                            self.bytes)
 
 
-def prepare_simulation(transfers, interval_length, date, date_range, file_name, heuristic_tup):
-    heuristic_name, heuristic_function = heuristic_tup
+# the intervals of a simulated day, stored as parallel numpy arrays of their bytes and transfer counts instead of
+# Interval objects holding lists of their transfers. Indexing or iterating over it gives Interval objects that have
+# their bytes and transfer counts set but no transfer lists. The start_time and length are integer microseconds
+class IntervalSeries(object):
+    __slots__ = ('start_time', 'length', 'OD_bytes', 'BE_bytes', 'OD_counts', 'BE_counts')
 
+    def __init__(self, start_time, interval_length, num_intervals):
+        self.start_time = start_time
+        self.length = interval_length
+
+        self.OD_bytes = numpy.zeros(num_intervals)
+        self.BE_bytes = numpy.zeros(num_intervals)
+        self.OD_counts = numpy.zeros(num_intervals, dtype=numpy.int64)
+        self.BE_counts = numpy.zeros(num_intervals, dtype=numpy.int64)
+
+    def __len__(self):
+        return len(self.OD_bytes)
+
+    @property
+    def bytes(self):
+        return self.OD_bytes + self.BE_bytes
+
+    @property
+    def end_time(self):
+        return self.start_time + len(self) * self.length
+
+    # the start times of the intervals, as microseconds since the epoch
+    def start_times(self):
+        return self.start_time + numpy.arange(len(self), dtype=numpy.int64) * self.length
+
+    def network_loads(self):
+        return self.bytes / (self.length / microseconds_per_second)
+
+    # index of the interval the time is in, which is out of range for times outside of the series
+    def index(self, time):
+        return (time - self.start_time) // self.length
+
+    # copy the bytes and transfer counts of a finished Interval into the series, ignoring intervals outside of it
+    def record(self, idx, interval):
+        if 0 <= idx < len(self):
+            self.OD_bytes[idx] = interval.OD_bytes
+            self.BE_bytes[idx] = interval.BE_bytes
+            self.OD_counts[idx] = interval.OD_count
+            self.BE_counts[idx] = interval.BE_count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            if step != 1:
+                raise ValueError('IntervalSeries can only be sliced with a step of 1')
+
+            series = IntervalSeries(self.start_time + start * self.length, self.length, 0)
+            series.OD_bytes = self.OD_bytes[start:stop]
+            series.BE_bytes = self.BE_bytes[start:stop]
+            series.OD_counts = self.OD_counts[start:stop]
+            series.BE_counts = self.BE_counts[start:stop]
+            return series
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('interval index out of range')
+
+        interval = Interval(self.start_time + idx * self.length, self.length)
+        interval.OD_bytes = float(self.OD_bytes[idx])
+        interval.BE_bytes = float(self.BE_bytes[idx])
+        interval.bytes = interval.OD_bytes + interval.BE_bytes
+        interval.OD_count = int(self.OD_counts[idx])
+        interval.BE_count = int(self.BE_counts[idx])
+        return interval
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __repr__(self):
+        return "(start_t: {}, end_t: {}, intervals: {})".format(to_datetime(self.start_time),
+                                                               to_datetime(self.end_time), len(self))
+
+
+# OD_transfer_percentages = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+default_OD_transfer_percentages = [0.1, 0.3, 0.5, 0.7, 0.9]
+
+
+# workers is the number of processes the OD percentage scenarios are run on, None runs them one after another.
+# Each scenario shuffles the transfers with its own random generator seeded from seed and its OD percentage, so
+# the results are the same however the scenarios are run. The intervals and transfer outcomes of every scenario are
+# saved to the output_logs folder in each of output_formats (see save_output.output_formats). Without plot nothing is
+# plotted (and matplotlib is never imported), otherwise the plots of scenarios run one after another are rendered on
+# plot_workers processes while the next scenarios are simulated. The intervals are also aggregated into intervals of
+# each of aggregate_lengths (multiples of interval_length), whose statistics are printed and saved with the rest
+def prepare_simulation(transfers, interval_length, date, date_range, file_name, heuristic_tup, engine='interval',
+                       OD_transfer_percentages=default_OD_transfer_percentages, workers=None, seed=None,
+                       queue_order='arrival', output_formats=(), plot=True, plot_workers=1, aggregate_lengths=()):
+    original_statistics, results = run_heuristics(transfers, interval_length, date, date_range, file_name,
+                                                  [heuristic_tup], engine, OD_transfer_percentages, workers, seed,
+                                                  queue_order, output_formats, plot, plot_workers,
+                                                  aggregate_lengths)
+    return results[heuristic_tup[0]]
+
+
+# run the OD percentage scenarios of several heuristics on the same transfers, sharing the Original simulation
+# between them, and write their statistics side by side to a csv file in the output_logs folder
+def compare_heuristics(transfers, interval_length, date, date_range, file_name, heuristic_tups, engine='interval',
+                       OD_transfer_percentages=default_OD_transfer_percentages, workers=None, seed=None,
+                       queue_order='arrival', output_formats=(), plot=True, plot_workers=1, aggregate_lengths=()):
+    original_statistics, results = run_heuristics(transfers, interval_length, date, date_range, file_name,
+                                                  heuristic_tups, engine, OD_transfer_percentages, workers, seed,
+                                                  queue_order, output_formats, plot, plot_workers,
+                                                  aggregate_lengths)
+
+    heuristic_names = [heuristic_name for heuristic_name, _ in heuristic_tups]
+    file_name = file_name[file_name.rindex('/')+1:]
+    table_filename = "output_logs/{}_{}_{}-transfers_{}_comparison.csv". \
+        format(file_name, date, len(transfers), '-'.join(heuristic_names))
+
+    bytes_per_megabyte = 1024 * 1024
+    header = ['OD_percentage']
+    for heuristic_name in heuristic_names:
+        header.extend(['{} {} (MiB/Second)'.format(heuristic_name, statistic) for statistic in
+                       ('mean', 'std deviation', 'median')])
+
+    rows = [['original'] + [value / bytes_per_megabyte for value in original_statistics] * len(heuristic_names)]
+    for idx, OD_percentage in enumerate(OD_transfer_percentages):
+        row = [OD_percentage]
+        for heuristic_name in heuristic_names:
+            row.extend(value / bytes_per_megabyte for value in results[heuristic_name][idx])
+        rows.append(row)
+
+    print('\nHeuristic comparison (mean / std deviation / median MiB/Second)')
+    print('{:>15}'.format('OD percentage') + ''.join(' | {:>32}'.format(name) for name in heuristic_names))
+    for row in rows:
+        print('{:>15}'.format(row[0]) + ''.join(' | {:>10.3f} {:>10.3f} {:>10.3f}'.format(*row[idx:idx + 3])
+                                                 for idx in range(1, len(row), 3)))
+
+    print("\nSaving heuristic comparison to %s" % table_filename)
+    with open(table_filename, 'w') as the_file:
+        the_file.write(', '.join(header) + '\n')
+        for row in rows:
+            the_file.write(', '.join(str(value) for value in row) + '\n')
+
+    return results
+
+
+# simulate the Original (all OD) intervals once and every OD percentage scenario for each heuristic.
+# Returns the statistics of the Original intervals and a dictionary from the heuristic names to the statistics of
+# their scenarios
+def run_heuristics(transfers, interval_length, date, date_range, file_name, heuristic_tups, engine,
+                   OD_transfer_percentages, workers, seed, queue_order, output_formats=(), plot=True,
+                   plot_workers=1, aggregate_lengths=()):
     # misc. setup work for the simulation
     file_name = file_name[file_name.rindex('/')+1:]
 
     interval_stat_str = 'Interval Statistics for {} - {} Transfers \nIntervals Between {} - {}'. \
         format(file_name, len(transfers), date_range[0], date_range[1])
 
-    plot_title = "{} - {} Heuristic on {} - {} Transfers".format(file_name, date, len(transfers))
-
     plots_folder = 'plots-xfer_data_logs'
-    # verify that the plots output folder exists, if it doesn't, then create it
-    if not exists(plots_folder):
-        makedirs(plots_folder)
+    if plot:
+        ensure_folder(plots_folder)
+
+    log_folder = ensure_folder('output_logs')
+
+    # the scenario workers plot their own scenarios, so only the Original plots are left to the plot pool then
+    with make_plot.PlotPool(plot_workers if plot else 0) as plot_pool:
+        original_statistics, tasks, task_results = run_heuristic_scenarios(
+            transfers, interval_length, date, file_name, heuristic_tups, engine, OD_transfer_percentages,
+            workers, seed, queue_order, output_formats, plot, plot_pool, plots_folder, log_folder, interval_stat_str,
+            aggregate_lengths)
+
+    results = {heuristic_name: [] for heuristic_name, _ in heuristic_tups}
+    for (heuristic_name, OD_percentage), (statistics, outcome_summary, aggregate_statistics, profile_report) in \
+            zip(tasks, task_results):
+        if profile_report is not None:
+            profiling.active_profiler.add_scenario('{} {} {}-OD'.format(date, heuristic_name, OD_percentage),
+                                                   profile_report)
+
+        printer = 'OD percentage: {} - '.format(OD_percentage) + interval_stat_str
+        if len(heuristic_tups) > 1:
+            printer = '{} Heuristic - '.format(heuristic_name) + printer
+        print_interval_statistics(statistics, printer)
+        for aggregate_length, aggregate_statistic in zip(aggregate_lengths, aggregate_statistics):
+            print_interval_statistics(aggregate_statistic, 'Aggregated to {} intervals'.format(aggregate_length))
+        transfer_metrics.print_summary(outcome_summary, 'Transfer outcomes (seconds, slowdown is a ratio)')
+        results[heuristic_name].append(statistics)
+
+    return original_statistics, results
+
+
+# the part of run_heuristics that runs while the plot pool is open. Returns the statistics of the Original intervals,
+# the (heuristic name, OD percentage) scenarios and their results
+def run_heuristic_scenarios(transfers, interval_length, date, file_name, heuristic_tups, engine,
+                            OD_transfer_percentages, workers, seed, queue_order, output_formats, plot, plot_pool,
+                            plots_folder, log_folder, interval_stat_str, aggregate_lengths):
+    # run the simulation using all of the transfers as OD
+    with profiling.phase('simulate_original'):
+        original_intervals = simulate_original(interval_length, date, transfers)
 
-    log_folder = 'output_logs'
-    # verify that the folder exists, if it doesn't, then create it
-    if not exists(log_folder):
-        makedirs(log_folder)
+    original_statistics = get_interval_statistics(original_intervals, 'Original ' + interval_stat_str)
+    mean, std, median = original_statistics
 
-    # run the simulation using all of the transfers as OD
-    tmp_transfers = copy.deepcopy(transfers)
-    # label all of the tmp_transfers as OD:
-    for transfer in tmp_transfers:
-        transfer.trans_type = TransferType.OD
+    log_file = "{}/{}_{}_{}-transfers_original_intervals".format(log_folder, file_name, date, len(transfers))
+    if len(output_formats) > 0:
+        save_output.save_intervals(log_file, original_intervals, output_formats)
 
-    original_intervals = simulate(interval_length, date, tmp_transfers, [], 0, heuristic_function)
+    # the Original transfers aren't recorded, so its aggregated transfer counts are only the most of any interval
+    for aggregate_length in aggregate_lengths:
+        aggregate_intervals = aggregate_interval_series(original_intervals, aggregate_length)
+        get_interval_statistics(aggregate_intervals, 'Original aggregated to {} intervals'.format(aggregate_length))
+        if len(output_formats) > 0:
+            save_output.save_intervals('{}_{:g}s'.format(log_file, aggregate_length.total_seconds()),
+                                       aggregate_intervals, output_formats)
 
-    mean, std, median = get_interval_statistics(original_intervals, 'Original ' + interval_stat_str)
+    scenarios = {}
+    for heuristic_tup in heuristic_tups:
+        heuristic_name = heuristic_tup[0]
+        plot_title = "{} - {} Heuristic on {} - {} Transfers".format(file_name, heuristic_name, date, len(transfers))
+
+        # plot the resulting intervals
+        if plot:
+            plot_filename = "{}/{}_{}_{}-transfers_original_{}.png". \
+                format(plots_folder, file_name, date, len(transfers), heuristic_name)
+            plot_pool.plot_intervals(plot_filename, plot_title, [('Original', original_intervals)])
+
+        scenarios[heuristic_name] = make_scenario(
+            interval_length, date, heuristic_tup, engine, queue_order, seed, network_capacity=mean * 2,
+            plot_title=plot_title, plots_folder=plots_folder, file_name=file_name,
+            original_intervals=original_intervals, log_folder=log_folder, output_formats=output_formats, plot=plot,
+            aggregate_lengths=aggregate_lengths, profile=profiling.scenario_capture())
+
+    tasks = [(heuristic_name, OD_percentage) for heuristic_name, _ in heuristic_tups
+             for OD_percentage in OD_transfer_percentages]
+
+    if workers is None:
+        # the scenarios reset and reuse the same transfers, so afterwards they hold the state of the last scenario
+        task_results = [run_OD_scenario(transfers, OD_percentage, scenarios[heuristic_name], plot_pool.plot_intervals)
+                        for heuristic_name, OD_percentage in tasks]
+    else:
+        # the transfers are sent to each worker once as numpy columns instead of pickling them for every scenario
+        columns = parse_xfer_data_logs.transfers_to_columns(transfers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_scenario_worker,
+                                 initargs=(columns, scenarios)) as executor:
+            task_results = list(executor.map(run_worker_OD_scenario, tasks))
+
+    return original_statistics, tasks, task_results
+
+
+# split the transfers into OD and BE transfers, simulate them and plot the result with plotter (which takes the
+# arguments of make_plot.plot_intervals), unless the scenario isn't plotted.
+# Returns the interval statistics of the simulation, the summary of the OD and BE transfer outcomes, the interval
+# statistics of the intervals aggregated to each of the scenario's aggregate_lengths and the profiling report of the
+# scenario (None unless the scenario's profile is the capture options of a profiling.Profiler)
+def run_OD_scenario(transfers, OD_percentage, scenario, plotter=make_plot.plot_intervals):
+    profiler = profiling.Profiler(scenario['profile']) if scenario.get('profile') is not None else None
+    with profiling.profiling(profiler, capture=True):
+        results = run_profiled_OD_scenario(transfers, OD_percentage, scenario, plotter)
+
+    return results + (profiler.report() if profiler is not None else None,)
+
+
+# the part of run_OD_scenario that is profiled
+def run_profiled_OD_scenario(transfers, OD_percentage, scenario, plotter):
+    with profiling.phase('simulate'):
+        new_intervals, metrics = simulate_OD_scenario(transfers, OD_percentage, scenario)
 
     # plot the resulting intervals
-    plot_filename = "{}/{}_{}_{}-transfers_original_{}.png". \
-        format(plots_folder, file_name, date, len(transfers), heuristic_name)
-    make_plot.plot_intervals(plot_filename, plot_title, [('Original', original_intervals)])
+    heuristic_name = scenario['heuristic_name']
+    if scenario['plot']:
+        plot_filename = "{}/{}/{}_{}_{}-transfers_{:.2f}-OD_{}.png". \
+            format(scenario['plots_folder'], heuristic_name, scenario['file_name'], scenario['date'], len(transfers),
+                   OD_percentage, heuristic_name)
+        intervals_list = [('Original', scenario['original_intervals']),
+                          ('{}% OD'.format(OD_percentage*100), new_intervals)]
+
+        with profiling.phase('plot'):
+            plotter(plot_filename, scenario['plot_title'], intervals_list)
+
+    # save the interval data and the transfer outcomes to log
+    if len(scenario['output_formats']) > 0:
+        log_file = "{}/{}_{}_{}-transfers_{:.2f}-OD_{}". \
+            format(scenario['log_folder'], scenario['file_name'], scenario['date'], len(transfers), OD_percentage,
+                   heuristic_name)
+        with profiling.phase('save_output'):
+            save_output.save_intervals(log_file + '_intervals', new_intervals, scenario['output_formats'])
+            save_output.save_transfer_outcomes(log_file + '_transfers', metrics, scenario['output_formats'])
+
+    # the coarser intervals are summed from the simulated ones instead of simulating the scenario again
+    aggregate_statistics = []
+    for aggregate_length in scenario['aggregate_lengths']:
+        with profiling.phase('aggregate_interval_series'):
+            aggregate_intervals = aggregate_interval_series(new_intervals, aggregate_length, metrics)
+        aggregate_statistics.append(get_interval_statistics(aggregate_intervals))
+        if len(scenario['output_formats']) > 0:
+            save_output.save_intervals('{}_intervals_{:g}s'.format(log_file, aggregate_length.total_seconds()),
+                                       aggregate_intervals, scenario['output_formats'])
+
+    with profiling.phase('statistics'):
+        return get_interval_statistics(new_intervals), metrics.summary(), aggregate_statistics
+
+
+# the scenario simulate_OD_scenario simulates, the heuristic (a (name, function) tuple) simulated on the engine. Any
+# other settings of the scenario (its network_capacity, what is plotted and saved of it) are added from extra
+def make_scenario(interval_length, date, heuristic_tup, engine='interval', queue_order='arrival', seed=None, **extra):
+    heuristic_name, heuristic_function = heuristic_tup
+    scenario = {
+        'interval_length': interval_length,
+        'date': date,
+        'heuristic_name': heuristic_name,
+        'heuristic_function': heuristic_function,
+        'simulate_function': simulation_engines[engine],
+        'queue_order': queue_order,
+        'seed': seed,
+    }
+    scenario.update(extra)
+    return scenario
+
+
+# randomly split the transfers into OD and BE transfers and simulate them. The split is seeded from the scenario's
+# seed, the OD percentage and the replication, so every split can be repeated on its own.
+# Returns the resulting intervals and the TransferMetrics of the transfers
+def simulate_OD_scenario(transfers, OD_percentage, scenario, replication=None):
+    OD_transfers, BE_transfers = split_OD_transfers(transfers, OD_percentage, scenario['seed'], replication)
+
+    metrics = transfer_metrics.TransferMetrics()
+    new_intervals = scenario['simulate_function'](scenario['interval_length'], scenario['date'], OD_transfers,
+                                                  BE_transfers, scenario['network_capacity'],
+                                                  scenario['heuristic_function'], scenario['queue_order'], metrics)
+
+    return new_intervals, metrics
+
+
+# the random generator of the OD/BE splits seeded with seed (an unseeded one for None). Every OD percentage and
+# replication of a seed gets a generator of its own, so its split doesn't depend on the other scenarios run
+def split_random(seed, OD_percentage, replication=None):
+    if seed is None:
+        return random.Random()
+    elif replication is None:
+        return random.Random('{}-{}'.format(seed, OD_percentage))
+    else:
+        return random.Random('{}-{}-{}'.format(seed, OD_percentage, replication))
+
+
+# reset the simulation state of the transfers and split them at random into OD_percentage OD transfers and BE
+# transfers, the same split for the same seed, OD percentage and replication. Returns the OD and BE transfers
+def split_OD_transfers(transfers, OD_percentage, seed=None, replication=None):
+    # shuffle the transfer order so we can randomly divide the transfers
+    order = list(range(len(transfers)))
+    split_random(seed, OD_percentage, replication).shuffle(order)
+
+    # calculate the number of OD and BE transfers and mark the OD transfers
+    OD_transfer_count = round(len(transfers) * OD_percentage)
+    OD_mask = numpy.zeros(len(transfers), dtype=bool)
+    OD_mask[order[:OD_transfer_count]] = True
+
+    # reset the simulation state of the transfers left by the previous scenario and label them as OD or BE
+    for transfer, is_OD in zip(transfers, OD_mask.tolist()):
+        transfer.reset(TransferType.OD if is_OD else TransferType.BE)
+
+    OD_transfers = [transfers[idx] for idx in order[:OD_transfer_count]]
+    BE_transfers = [transfers[idx] for idx in order[OD_transfer_count:]]
+
+    return OD_transfers, BE_transfers
+
+
+# names of the values run_replication returns for every replication
+replication_values = ['mean', 'std deviation', 'median', 'BE wait', 'BE delay']
+
+
+# simulate one replication of an OD percentage scenario. Returns the interval statistics (bytes/second) and the
+# mean time (seconds) BE transfers waited to start and finished after their requested end time
+def run_replication(transfers, OD_percentage, scenario, replication):
+    new_intervals, metrics = simulate_OD_scenario(transfers, OD_percentage, scenario, replication)
+
+    trans_types, outcomes = metrics.outcomes()
+    is_BE = trans_types == TransferType.BE.value
+    mean_wait = outcomes['wait'][is_BE].mean() if is_BE.any() else 0.0
+    mean_delay = outcomes['delay'][is_BE].mean() if is_BE.any() else 0.0
+
+    return get_interval_statistics(new_intervals) + (mean_wait, mean_delay)
+
+
+# run replications seeded OD/BE splits of every OD percentage scenario and summarize each value of the replications
+# by its mean, standard deviation and a (Student's t) confidence interval of the mean. The replications
+# are seeded on their own, so the results don't depend on how many workers run them. The summary is printed and
+# written to a csv file in the output_logs folder
+def run_replications(transfers, interval_length, date, file_name, heuristic_tup, replications,
+                     engine='interval', OD_transfer_percentages=default_OD_transfer_percentages, workers=None,
+                     seed=None, queue_order='arrival', confidence=0.95):
+    heuristic_name = heuristic_tup[0]
+    file_name = file_name[file_name.rindex('/')+1:]
 
-    # OD_transfer_percentages = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
-    OD_transfer_percentages = [0.1, 0.3, 0.5, 0.7, 0.9]
-    for OD_percentage in OD_transfer_percentages:
-        tmp_transfers = copy.deepcopy(transfers)
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+        print('\nReplications seeded with {}'.format(seed))
+
+    log_folder = ensure_folder('output_logs')
+
+    original_intervals = simulate_original(interval_length, date, transfers)
+    mean, std, median = get_interval_statistics(original_intervals)
+
+    scenario = make_scenario(interval_length, date, heuristic_tup, engine, queue_order, seed, network_capacity=mean * 2)
+
+    tasks = [(heuristic_name, OD_percentage, replication) for OD_percentage in OD_transfer_percentages
+             for replication in range(replications)]
+
+    if workers is None:
+        task_results = [run_replication(transfers, OD_percentage, scenario, replication)
+                        for _, OD_percentage, replication in tasks]
+    else:
+        columns = parse_xfer_data_logs.transfers_to_columns(transfers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_scenario_worker,
+                                 initargs=(columns, {heuristic_name: scenario})) as executor:
+            task_results = list(executor.map(run_worker_replication, tasks))
+
+    # one replication has no spread to estimate, its confidence interval is only its value
+    t = t_quantile(confidence, replications - 1) if replications > 1 else 0.0
+    summaries = {}
+    for idx, OD_percentage in enumerate(OD_transfer_percentages):
+        values = numpy.array(task_results[idx * replications:(idx + 1) * replications], dtype=numpy.float64)
+        value_means = values.mean(axis=0)
+        value_stds = values.std(axis=0, ddof=1) if replications > 1 else numpy.zeros(values.shape[1])
+        half_widths = t * value_stds / numpy.sqrt(replications)
+        summaries[OD_percentage] = [(value_mean, value_std, value_mean - half_width, value_mean + half_width)
+                                    for value_mean, value_std, half_width in zip(value_means, value_stds,
+                                                                                 half_widths)]
+
+    summary_filename = "{}/{}_{}_{}-transfers_{}_{}-replications.csv". \
+        format(log_folder, file_name, date, len(transfers), heuristic_name, replications)
+
+    print('\n{} Heuristic - {} replications (seed {}), mean +- {:.0%} confidence interval'.
+          format(heuristic_name, replications, seed, confidence))
+    print('rates in MiB/Second, times in seconds')
+    with open(summary_filename, 'w') as the_file:
+        the_file.write('OD_percentage, value, mean, std deviation, confidence interval low, '
+                       'confidence interval high\n')
+
+        for OD_percentage, summary in summaries.items():
+            print('OD percentage: {}'.format(OD_percentage))
+            for value_name, (value_mean, value_std, low, high) in zip(replication_values, summary):
+                scale = 1024 * 1024 if value_name in ('mean', 'std deviation', 'median') else 1
+                print('    {:>15}: {:.4f} +- {:.4f} (std deviation {:.4f})'.
+                      format(value_name, value_mean / scale, (high - value_mean) / scale, value_std / scale))
+                the_file.write('{}, {}, {}, {}, {}, {}\n'.format(OD_percentage, value_name, value_mean, value_std,
+                                                                low, high))
+
+    print("\nSaving replication summary to %s" % summary_filename)
+
+    return summaries
+
+
+# the probability that a value of Student's t distribution with (a whole number of) df degrees of freedom is within
+# +-sqrt(df) * tan(theta), from the finite sums of Abramowitz and Stegun 26.7.3 and 26.7.4
+def t_probability_within(theta, df):
+    cos_theta = math.cos(theta)
+    total = 0.0
+    if df % 2 == 1:
+        # cos + 2/3 cos^3 + (2 * 4)/(3 * 5) cos^5 + ... up to cos^(df - 2)
+        term = cos_theta
+        for k in range(1, (df - 1) // 2 + 1):
+            total += term
+            term *= cos_theta * cos_theta * 2 * k / (2 * k + 1)
+        return 2 / math.pi * (theta + math.sin(theta) * total)
+
+    # 1 + 1/2 cos^2 + (1 * 3)/(2 * 4) cos^4 + ... up to cos^(df - 2)
+    term = 1.0
+    for k in range(1, df // 2 + 1):
+        total += term
+        term *= cos_theta * cos_theta * (2 * k - 1) / (2 * k)
+    return math.sin(theta) * total
+
+
+# the half width (in standard errors) of a two sided confidence interval of Student's t distribution with df degrees
+# of freedom, which the mean of a few replications follows rather than the normal distribution
+def t_quantile(confidence, df):
+    low, high = 0.0, math.pi / 2
+    for _ in range(100):
+        theta = (low + high) / 2
+        if t_probability_within(theta, df) < confidence:
+            low = theta
+        else:
+            high = theta
+    return math.sqrt(df) * math.tan((low + high) / 2)
 
-        # shuffle the temp transfer list so we can randomly divide the list
-        random.shuffle(tmp_transfers)
 
-        # calculate the number of OD and BE transfers and make the appropriate lists
-        OD_transfer_count = round(len(tmp_transfers) * OD_percentage)
+# the outcomes of BE transfers a capacity search can target: their slowdown, the time from their requested start
+# to their end divided by their requested transfer time, or their delay, the seconds they ended after their
+# requested end time
+capacity_targets = ['slowdown', 'delay']
 
-        OD_transfers = tmp_transfers[:OD_transfer_count]
-        # label all of the OD_transfers as OD:
-        for transfer in OD_transfers:
-            transfer.trans_type = TransferType.OD
 
-        BE_transfers = tmp_transfers[OD_transfer_count:]
-        # label all of the BE_transfers as BE:
-        for transfer in BE_transfers:
-            transfer.trans_type = TransferType.BE
+# the percentile of the target outcome of the BE transfers when simulated with the given network capacity
+def probe_capacity(transfers, OD_percentage, scenario, network_capacity, target_metric, percentile):
+    scenario = dict(scenario, network_capacity=network_capacity)
+    new_intervals, metrics = simulate_OD_scenario(transfers, OD_percentage, scenario)
 
-        net_cap = mean * 2
-        new_intervals = simulate(interval_length, date, OD_transfers, BE_transfers, net_cap, heuristic_function)
+    trans_types, outcomes = metrics.outcomes()
+    outcomes = outcomes[target_metric][trans_types == TransferType.BE.value]
 
-        get_interval_statistics(new_intervals, 'OD percentage: {} - '.format(OD_percentage) + interval_stat_str)
+    return numpy.percentile(outcomes, percentile) if len(outcomes) > 0 else 0.0
 
-        # plot the resulting intervals
-        plot_filename = "{}/{}/{}_{}_{}-transfers_{:.2f}-OD_{}.png". \
-            format(plots_folder, heuristic_name, file_name, date, len(transfers), OD_percentage, heuristic_name)
-        intervals_list = [('Original', original_intervals), ('{}% OD'.format(OD_percentage*100), new_intervals)]
 
-        make_plot.plot_intervals(plot_filename, plot_title, intervals_list)
+# find the smallest network capacity (bytes/second) at which the percentile of the target outcome of the BE
+# transfers is at most target_value. The split into OD and BE transfers is the same for every probe, so the outcome
+# only depends on the capacity. Probes bisect the capacity until it is known to within tolerance (relative), with
+# workers the interval is split into workers + 1 parts by probes run at the same time instead.
+# Returns the capacity and its outcome
+def find_capacity(transfers, interval_length, date, heuristic_tup, OD_percentage, target_value,
+                  target_metric='slowdown', percentile=95, engine='interval', workers=None, seed=0,
+                  queue_order='arrival', tolerance=0.01, max_probes=64):
+    heuristic_name = heuristic_tup[0]
 
-        # save the interval data to log
-        # log_file = "{}/{}_{}_{}-transfers_{:.2f}-OD_percentage.csv". \
-        #     format(log_folder, file_name, date, len(transfers), OD_percentage)
-        #
-        # with open(log_file, 'w') as the_file:
-        #     the_file.write( new_intervals[0].log_header())
-        #     for interval in new_intervals:
-        #         the_file.write(interval.save_to_log())
+    if round(len(transfers) * OD_percentage) == len(transfers):
+        print('There are no BE transfers, so any capacity meets the target')
+        return 0.0, 0.0
 
+    original_intervals = simulate_original(interval_length, date, transfers)
+    mean, std, median = get_interval_statistics(original_intervals)
 
-def simulate(interval_length, date, OD_transfers, BE_transfers, network_capacity, heuristic):
+    scenario = make_scenario(interval_length, date, heuristic_tup, engine, queue_order, seed)
 
-    # make intervals to use for the simulation
-    intervals = make_intervals_given_transfers(interval_length, date, OD_transfers, BE_transfers)
-    # intervals = make_intervals(interval_length, interval_start_time, interval_end_time)
+    outcomes = {}
+    num_probes = [0]
+    executor = None
+    if workers is not None:
+        columns = parse_xfer_data_logs.transfers_to_columns(transfers)
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_scenario_worker,
+                                       initargs=(columns, {heuristic_name: scenario}))
 
-    unqueued_OD = sorted(OD_transfers, key=attrgetter('requested_start_time'))
-    unqueued_BE = sorted(BE_transfers, key=attrgetter('requested_start_time'))
-    queued_OD = []
-    queued_BE = []
+    def probe(capacities):
+        if executor is None:
+            values = [probe_capacity(transfers, OD_percentage, scenario, capacity, target_metric, percentile)
+                      for capacity in capacities]
+        else:
+            values = list(executor.map(run_worker_capacity_probe,
+                                       [(heuristic_name, OD_percentage, capacity, target_metric, percentile)
+                                        for capacity in capacities]))
+
+        num_probes[0] += len(capacities)
+        for capacity, value in zip(capacities, values):
+            print('capacity {:.4f} MiB/Second - {} percentile BE {}: {:.4f}'.
+                  format(capacity / (1024 * 1024), percentile, target_metric, value))
+            outcomes[capacity] = value
+
+    probes_at_once = 1 if workers is None else workers
+    try:
+        # the BE transfers can never start without any capacity, so the search starts above 0 and doubles the
+        # capacity from the one prepare_simulation uses until it meets the target
+        low, high = 0.0, mean * 2
+        best_value = None
+        while num_probes[0] < max_probes:
+            capacities = [high * 2 ** idx for idx in range(probes_at_once)]
+            probe(capacities)
+            passing = [capacity for capacity in capacities if outcomes[capacity] <= target_value]
+            if len(passing) > 0:
+                high = min(passing)
+                low = max([low] + [capacity for capacity in capacities if capacity < high])
+                break
+
+            # transfers still wait for the next interval to start with unlimited capacity, so past some capacity
+            # the outcome stops improving and the target can't be met
+            round_value = min(outcomes[capacity] for capacity in capacities)
+            if best_value is not None and round_value >= best_value:
+                print('The BE {} stops improving at {:.4f}, the target can not be met'.
+                      format(target_metric, best_value))
+                return None, None
+            best_value = round_value
+            low, high = capacities[-1], capacities[-1] * 2
+        else:
+            print('No capacity meeting the target was found in {} probes'.format(max_probes))
+            return None, None
+
+        while high - low > tolerance * high and num_probes[0] < max_probes:
+            capacities = [low + (high - low) * idx / (probes_at_once + 1) for idx in range(1, probes_at_once + 1)]
+            probe(capacities)
+            for capacity in capacities:
+                if outcomes[capacity] <= target_value:
+                    high = capacity
+                    break
+                low = capacity
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print('\nSmallest capacity meeting a {} percentile BE {} of {}: {:.4f} MiB/Second ({:.2f} x the Original mean)'.
+          format(percentile, target_metric, target_value, high / (1024 * 1024), high / mean))
+    return high, outcomes[high]
+
+
+# simulate the days from first_date up to and including last_date of a log as one run while the log is read, instead
+# of parsing the whole log first. There is no Original simulation to take the network capacity (bytes/second) from,
+# so it has to be given. The intervals and transfer outcomes are written to csv files in the output_logs folder as
+# they are done and the interval statistics (with quantiles to within relative_accuracy) are kept while they are.
+# Returns the IntervalStatistics of the run
+def run_stream(file_name, interval_length, first_date, last_date, heuristic_tup, OD_percentage, network_capacity,
+               seed=None, queue_order='arrival', relative_accuracy=interval_statistics.default_relative_accuracy):
+    heuristic_name, heuristic_function = heuristic_tup
+    start_time = to_microseconds(datetime.datetime(year=first_date.year, month=first_date.month, day=first_date.day))
+    end_time = to_microseconds(datetime.datetime(year=last_date.year, month=last_date.month, day=last_date.day) +
+                               datetime.timedelta(days=1))
+    interval_length = to_microseconds(interval_length)
+
+    log_folder = ensure_folder('output_logs')
+
+    log_file = "{}/{}_{}_{}_{:.2f}-OD_{}_stream". \
+        format(log_folder, file_name[file_name.rfind('/')+1:], first_date, last_date, OD_percentage, heuristic_name)
+
+    print('\n{} Heuristic - streaming {} from {} to {}'.format(heuristic_name, file_name, first_date, last_date))
+    statistics = interval_statistics.IntervalStatistics(network_capacity, relative_accuracy)
+    with save_output.IntervalCsvWriter(log_file + '_intervals.csv', interval_length) as interval_writer, \
+            save_output.TransferCsvWriter(log_file + '_transfers.csv') as transfer_writer:
+        num_intervals = simulate_stream(parse_xfer_data_logs.iter_log_transfers(file_name), interval_length,
+                                        OD_percentage, network_capacity, heuristic_function, queue_order, seed,
+                                        start_time, end_time, interval_writer, transfer_writer, statistics)
+
+    statistics.print_summary('OD percentage: {} - Interval Statistics of {} intervals, network capacity {} MiB/Second'.
+                             format(OD_percentage, num_intervals, network_capacity / (1024 * 1024)))
+    print('\nSaved {} intervals to {} and the transfers to {}'.format(num_intervals, interval_writer.file_name,
+                                                                     transfer_writer.file_name))
+    return statistics
+
+
+# simulate every site (see site_config.SiteConfig) as a link of its own on the given day. The transfers of the day are
+# sharded by the site of their ip_address and the shards are simulated on workers processes (None simulates them one
+# after another), each shard is only sent to the worker simulating it. Every shard is split into OD and BE transfers
+# like a scenario and simulated with the capacity of its site, or twice the mean of its Original intervals if the
+# site has no capacity. The interval series of the sites are summed into the aggregate intervals of all of them.
+# The statistics of every site are printed and saved to the output_logs folder, and the intervals and transfer
+# outcomes of every site and of the aggregate in each of output_formats.
+# Returns the statistics of the aggregate intervals and a dictionary from the sites to their statistics
+def run_sites(transfer_index, interval_length, date, file_name, heuristic_tup, site_config, OD_percentage,
+              engine='interval', workers=None, seed=None, queue_order='arrival', output_formats=(), plot=True):
+    heuristic_name = heuristic_tup[0]
+    file_name = file_name[file_name.rfind('/')+1:]
 
-    interval_idx = -1
-    current_interval = intervals[0]
+    date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
+    indices = transfer_index.indices_in_window(date_time, date_time + datetime.timedelta(days=1))
+    shards = shard_by_site(transfer_index.columns, indices, site_config)
+    if len(shards) == 0:
+        print('\nThere are no transfers on {}'.format(date))
+        return None, {}
+
+    scenario = make_scenario(interval_length, date, heuristic_tup, engine, queue_order, seed)
+
+    # the largest shards are simulated first, so the workers aren't left waiting on a large shard started last
+    sites = sorted(shards, key=lambda site: len(shards[site]), reverse=True)
+    tasks = [(transfer_index.columns.take(shards[site]), site_config.capacity(site), OD_percentage, scenario)
+             for site in sites]
+
+    if workers is None:
+        task_results = [run_site(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            task_results = list(executor.map(run_site, tasks))
+
+    original_intervals = merge_interval_series([original for _, _, original, _, _ in task_results])
+    new_intervals = merge_interval_series([intervals for _, _, _, intervals, _ in task_results])
+    metrics = transfer_metrics.TransferMetrics()
+    for _, _, _, _, site_metrics in task_results:
+        metrics.extend(site_metrics)
+
+    log_folder = ensure_folder('output_logs')
+
+    log_file = "{}/{}_{}_{}-sites_{:.2f}-OD_{}".format(log_folder, file_name, date, len(sites), OD_percentage,
+                                                       heuristic_name)
+
+    bytes_per_megabyte = 1024 * 1024
+    header = ['site', 'transfers', 'network_capacity (MiB/Second)', 'original mean (MiB/Second)'] + \
+        ['{} (MiB/Second)'.format(statistic) for statistic in ('mean', 'std deviation', 'median')]
+
+    site_statistics = {}
+    rows = []
+    for site, (num_transfers, network_capacity, site_original, site_intervals, _) in zip(sites, task_results):
+        site_statistics[site] = get_interval_statistics(site_intervals)
+        rows.append([site, num_transfers, network_capacity / bytes_per_megabyte,
+                     get_interval_statistics(site_original)[0] / bytes_per_megabyte] +
+                    [value / bytes_per_megabyte for value in site_statistics[site]])
+
+        if len(output_formats) > 0:
+            save_output.save_intervals('{}_site-{}_intervals'.format(log_file, site.replace('/', '_')),
+                                       site_intervals, output_formats)
+
+    print('\n{} Heuristic - {} sites on {}, {} OD (MiB/Second)'.format(heuristic_name, len(sites), date,
+                                                                       OD_percentage))
+    print('{:>20} | {:>9} | {:>10} | {:>10} | {:>10} {:>10} {:>10}'.
+          format('site', 'transfers', 'capacity', 'original', 'mean', 'std dev', 'median'))
+    for row in rows:
+        print('{:>20} | {:>9} | {:>10.3f} | {:>10.3f} | {:>10.3f} {:>10.3f} {:>10.3f}'.format(*row))
+
+    sites_filename = log_file + '_sites.csv'
+    print("\nSaving site statistics to %s" % sites_filename)
+    with open(sites_filename, 'w') as the_file:
+        the_file.write(', '.join(header) + '\n')
+        for row in rows:
+            the_file.write(', '.join(str(value) for value in row) + '\n')
+
+    statistics = get_interval_statistics(new_intervals)
+    print_interval_statistics(get_interval_statistics(original_intervals),
+                              'Original Interval Statistics of all {} sites'.format(len(sites)))
+    print_interval_statistics(statistics, 'Interval Statistics of all {} sites'.format(len(sites)))
+    transfer_metrics.print_summary(metrics.summary(), 'Transfer outcomes (seconds, slowdown is a ratio)')
+
+    if len(output_formats) > 0:
+        save_output.save_intervals(log_file + '_original_intervals', original_intervals, output_formats)
+        save_output.save_intervals(log_file + '_intervals', new_intervals, output_formats)
+        save_output.save_transfer_outcomes(log_file + '_transfers', metrics, output_formats)
+
+    if plot:
+        plot_filename = "plots-xfer_data_logs/{}/{}_{}_{}-sites_{:.2f}-OD_{}.png". \
+            format(heuristic_name, file_name, date, len(sites), OD_percentage, heuristic_name)
+        plot_title = "{} - {} Heuristic on {} - {} Sites".format(file_name, heuristic_name, date, len(sites))
+        make_plot.plot_intervals(plot_filename, plot_title, [('Original', original_intervals),
+                                                             ('{}% OD'.format(OD_percentage*100), new_intervals)])
+
+    return statistics, site_statistics
+
+
+# the indices (into columns) of the transfers of every site, of the transfers at the given indices
+def shard_by_site(columns, indices, site_config):
+    ip_addresses, ip_codes = numpy.unique(columns.ip_addresses[indices].astype(str), return_inverse=True)
+    site_codes = {}
+    ip_site_codes = numpy.array([site_codes.setdefault(site_config.site_of(ip_address), len(site_codes))
+                                 for ip_address in ip_addresses.tolist()], dtype=numpy.int64)
+
+    transfer_site_codes = ip_site_codes[ip_codes.ravel()] if len(ip_addresses) > 0 else ip_codes
+    return {site: indices[transfer_site_codes == site_code] for site, site_code in site_codes.items()}
+
+
+# simulate the shard of a site, a task of run_sites. Returns the number of transfers, the network capacity, the
+# Original and simulated intervals and the TransferMetrics of the site's transfers
+def run_site(task):
+    columns, network_capacity, OD_percentage, scenario = task
+    transfers = columns.transfers()
+
+    original_intervals = simulate_original(scenario['interval_length'], scenario['date'], transfers)
+    if network_capacity is None:
+        network_capacity = get_interval_statistics(original_intervals)[0] * 2
+
+    new_intervals, metrics = simulate_OD_scenario(transfers, OD_percentage,
+                                                  dict(scenario, network_capacity=network_capacity))
+
+    return len(transfers), network_capacity, original_intervals, new_intervals, metrics
+
+
+# state shared by all of the scenarios run in a worker process, set once by init_scenario_worker
+worker_state = {}
+
+
+def init_scenario_worker(columns, scenarios):
+    worker_state['transfers'] = columns.transfers()
+    worker_state['scenarios'] = scenarios
+
+
+def run_worker_OD_scenario(task):
+    heuristic_name, OD_percentage = task
+    return run_OD_scenario(worker_state['transfers'], OD_percentage, worker_state['scenarios'][heuristic_name])
+
+
+def run_worker_capacity_probe(task):
+    heuristic_name, OD_percentage, network_capacity, target_metric, percentile = task
+    return probe_capacity(worker_state['transfers'], OD_percentage, worker_state['scenarios'][heuristic_name],
+                          network_capacity, target_metric, percentile)
+
+
+def run_worker_replication(task):
+    heuristic_name, OD_percentage, replication = task
+    return run_replication(worker_state['transfers'], OD_percentage, worker_state['scenarios'][heuristic_name],
+                           replication)
+
+
+# queue_order is the name of the order (in queue_orders) the heuristic takes queued transfers in. Every transfer is
+# recorded in metrics (a TransferMetrics) once it has finished, if metrics are given
+def simulate(interval_length, date, OD_transfers, BE_transfers, network_capacity, heuristic, queue_order='arrival',
+             metrics=None):
+
+    # the intervals of the day are kept, the ones before and after it are only made while they are simulated
+    intervals = make_day_intervals(interval_length, date)
+    first_start_time = first_interval_start(interval_length, date, OD_transfers, BE_transfers)
+
+    arrivals = heapq.merge(sorted(OD_transfers, key=attrgetter('requested_start_time')),
+                           sorted(BE_transfers, key=attrgetter('requested_start_time')),
+                           key=attrgetter('requested_start_time'))
+    for interval in step_intervals(first_start_time, intervals.length, arrivals, network_capacity, heuristic,
+                                   queue_order, metrics):
+        intervals.record(intervals.index(interval.start_time), interval)
+
+    return intervals
+
+
+# the interval stepping core of simulate(). arrivals is an iterable of OD and BE transfers in order of their
+# requested_start_time, which is only read up to the interval being simulated, and every interval is yielded (with its
+# transfers) once it is done, starting at first_start_time (in microseconds, interval_length too). Only the transfers
+# that are queued or running are held on to, the finished ones are recorded in metrics and dropped
+def step_intervals(first_start_time, interval_length, arrivals, network_capacity, heuristic, queue_order='arrival',
+                   metrics=None):
+    arrivals = iter(arrivals)
+    next_transfer = next(arrivals, None)
+    queued_OD = queue_orders[queue_order]()
+    queued_BE = queue_orders[queue_order]()
+    profiler = profiling.active_profiler
+
+    start_time = first_start_time
+    current_interval = Interval(start_time - interval_length, interval_length)
 
     # iterate until all of the transfers have been completely simulated
-    while len(unqueued_OD) > 0 or len(unqueued_BE) or len(queued_OD) > 0 or len(queued_BE) > 0 or\
+    while next_transfer is not None or len(queued_OD) > 0 or len(queued_BE) > 0 or\
             len(current_interval.BE_transfers) > 0 or len(current_interval.OD_transfers) > 0:
 
-        interval_idx += 1
-        if interval_idx >= len(intervals):
-            add_interval(intervals)
-
         previous_interval = current_interval
-        current_interval = intervals[interval_idx]
+        current_interval = Interval(start_time, interval_length)
+        start_time += interval_length
 
         # only add OD_transfers that are still transferring during this interval
         for transfer in previous_interval.OD_transfers:
             if transfer.end_time > current_interval.start_time:
                 current_interval.add_transfer(transfer)
+            elif metrics is not None:
+                metrics.record(transfer)
 
         # only add BE_transfers that are still transferring during this interval
         for transfer in previous_interval.BE_transfers:
             if transfer.end_time > current_interval.start_time:
                 current_interval.add_transfer(transfer)
+            elif metrics is not None:
+                metrics.record(transfer)
 
-        # add any unqueued_OD_transfers to the queued list
-        while len(unqueued_OD) > 0 and \
-                        unqueued_OD[0].requested_start_time < current_interval.start_time:
-            queued_OD.append(unqueued_OD.pop(0))
-
-        # add any unqueued_BE_transfers to the queued list
-        while len(unqueued_BE) > 0 and\
-                        unqueued_BE[0].requested_start_time < current_interval.start_time:
-            queued_BE.append(unqueued_BE.pop(0))
+        # add the transfers requested before this interval to their queued list
+        while next_transfer is not None and next_transfer.requested_start_time < current_interval.start_time:
+            if next_transfer.trans_type is TransferType.OD:
+                queued_OD.push(next_transfer)
+            else:
+                queued_BE.push(next_transfer)
+            next_transfer = next(arrivals, None)
 
         # # for job in OD job queue, run job
         # while len(queued_OD) > 0:
@@ -202,7 +930,11 @@ def simulate(interval_length, date, OD_transfers, BE_transfers, network_capacity
         #     current_interval.add_transfer(transfer)
 
         # run the new transfers based on the current heuristic
-        heuristic(current_interval, queued_OD, queued_BE, network_capacity)
+        if profiler is None:
+            heuristic(current_interval, queued_OD, queued_BE, network_capacity)
+        else:
+            run_profiled_heuristic(profiler, heuristic, current_interval, queued_OD, queued_BE, network_capacity)
+            update_start_time = perf_counter()
 
         # update all the transfers by subtracting the bytes transferred during the current interval
         for transfer in current_interval.OD_transfers:
@@ -210,128 +942,621 @@ def simulate(interval_length, date, OD_transfers, BE_transfers, network_capacity
         for transfer in current_interval.BE_transfers:
             transfer.update_bytes_for_interval(current_interval)
 
+        if profiler is not None:
+            profiler.add_time('update_bytes_for_interval', perf_counter() - update_start_time)
+            profiler.count('intervals')
+
         # Set bytes for current_interval now that we're done with it
         current_interval.bytes = current_interval.OD_bytes + current_interval.BE_bytes
+        yield current_interval
+
+
+# run the heuristic of an interval for the profiler, timing it and counting the transfers it started out of the
+# queues and the ones it held back in them
+def run_profiled_heuristic(profiler, heuristic, current_interval, queued_OD, queued_BE, network_capacity):
+    queued_count = len(queued_OD) + len(queued_BE)
+    start_time = perf_counter()
+    heuristic(current_interval, queued_OD, queued_BE, network_capacity)
+    profiler.add_time('heuristic', perf_counter() - start_time)
+
+    held_count = len(queued_OD) + len(queued_BE)
+    profiler.count('heuristic invocations')
+    profiler.count('transfers admitted', queued_count - held_count)
+    profiler.count('transfers held back', held_count)
+    profiler.observe('OD queue depth', len(queued_OD))
+    profiler.observe('BE queue depth', len(queued_BE))
+
+
+# simulate the transfers of a log that is too large to be held in memory. transfers is an iterable of transfers in
+# order of their requested_start_time (like parse_xfer_data_logs.iter_log_transfers) that is only read as far as the
+# interval being simulated. Without all of the transfers to shuffle, every transfer is made OD with the probability
+# OD_percentage, drawn from a generator seeded like the scenarios. The transfers running between start_time and
+# end_time (microseconds, None for no limit) are simulated and the transfers are read no further than end_time.
+# The intervals (interval_length microseconds, counted from start_time) between start_time and end_time are given to
+# interval_writer as they are done and the transfers to transfer_writer as they finish (anything with a record
+# method, like the save_output csv writers), so only the queued and running transfers are held in memory. The
+# intervals are also added to statistics (an interval_statistics.IntervalStatistics), if given.
+# Returns the number of intervals written
+def simulate_stream(transfers, interval_length, OD_percentage, network_capacity, heuristic, queue_order='arrival',
+                    seed=None, start_time=None, end_time=None, interval_writer=None, transfer_writer=None,
+                    statistics=None):
+    rng = split_random(seed, OD_percentage)
+    arrivals = split_transfer_stream(transfers, OD_percentage, rng, start_time, end_time)
+
+    first_transfer = next(arrivals, None)
+    if first_transfer is None:
+        return 0
+
+    # like first_interval_start, the intervals are on the grid of interval_length from start_time and the first one
+    # is at or before the first transfer
+    if start_time is None:
+        grid_start_time = first_transfer.requested_start_time // interval_length * interval_length
+    else:
+        grid_start_time = start_time
+    first_start_time = grid_start_time + \
+        min((first_transfer.requested_start_time - grid_start_time) // interval_length, 0) * interval_length
+
+    num_intervals = 0
+    for interval in step_intervals(first_start_time, interval_length, chain([first_transfer], arrivals),
+                                   network_capacity, heuristic, queue_order, transfer_writer):
+        if start_time is not None and interval.start_time < start_time:
+            continue
+        if end_time is not None and interval.start_time >= end_time:
+            continue
+
+        num_intervals += 1
+        if interval_writer is not None:
+            interval_writer.record(interval)
+        if statistics is not None:
+            statistics.record(interval)
+
+    return num_intervals
+
+
+# the transfers of simulate_stream running between start_time and end_time, each reset as an OD or BE transfer
+def split_transfer_stream(transfers, OD_percentage, rng, start_time, end_time):
+    last_start_time = None
+    for transfer in transfers:
+        if last_start_time is not None and transfer.requested_start_time < last_start_time:
+            raise ValueError('Transfers have to be streamed in order of their requested start time - {}'.
+                             format(transfer))
+        last_start_time = transfer.requested_start_time
+
+        if end_time is not None and transfer.requested_start_time >= end_time:
+            return
+        if start_time is not None and transfer.requested_end_time < start_time:
+            continue
+
+        transfer.reset(TransferType.OD if rng.random() < OD_percentage else TransferType.BE)
+        yield transfer
+
+
+# event driven alternative to simulate(). Instead of stepping through every interval it jumps between the
+# intervals where something can change (transfers are queued, a transfer finishes or has its rate changed), runs the
+# heuristic only there and bins the transferred bytes into the intervals once all of the transfers are done
+def simulate_events(interval_length, date, OD_transfers, BE_transfers, network_capacity, heuristic,
+                    queue_order='arrival', metrics=None):
+
+    intervals = make_day_intervals(interval_length, date)
+    first_start_time = first_interval_start(interval_length, date, OD_transfers, BE_transfers)
+    interval_length = intervals.length
+
+    unqueued_OD = sorted(OD_transfers, key=attrgetter('requested_start_time'))
+    unqueued_BE = sorted(BE_transfers, key=attrgetter('requested_start_time'))
+    next_OD = 0
+    next_BE = 0
+    queued_OD = queue_orders[queue_order]()
+    queued_BE = queue_orders[queue_order]()
+
+    running_transfers = []
+    # (start time, rate, bytes left at start time) for every rate a transfer ran at
+    rate_segments = {}
+    # heap of the interval indices where the heuristic has to be run again
+    events = []
+    profiler = profiling.active_profiler
+
+    while True:
+        # transfers are queued in the first interval starting after their requested_start_time
+        candidates = events[:1]
+        if next_OD < len(unqueued_OD):
+            candidates.append((unqueued_OD[next_OD].requested_start_time - first_start_time) // interval_length + 1)
+        if next_BE < len(unqueued_BE):
+            candidates.append((unqueued_BE[next_BE].requested_start_time - first_start_time) // interval_length + 1)
+        if len(candidates) == 0:
+            break
 
-    # Once the simulation is done, trim the intervals if required
-    intervals = trim_intervals(intervals, date)
+        # like simulate(), anything requested before the first interval is queued in the first interval
+        interval_idx = max(min(candidates), 0)
+        while len(events) > 0 and events[0] <= interval_idx:
+            heapq.heappop(events)
+
+        current_interval = Interval(first_start_time + interval_idx * interval_length, interval_length)
+        current_time = current_interval.start_time
+
+        # add any unqueued transfers to the queued lists
+        while next_OD < len(unqueued_OD) and unqueued_OD[next_OD].requested_start_time < current_time:
+            queued_OD.push(unqueued_OD[next_OD])
+            next_OD += 1
+        while next_BE < len(unqueued_BE) and unqueued_BE[next_BE].requested_start_time < current_time:
+            queued_BE.push(unqueued_BE[next_BE])
+            next_BE += 1
+
+        # only add transfers that are still transferring during this interval
+        if metrics is not None:
+            for transfer in running_transfers:
+                if transfer.end_time <= current_time:
+                    metrics.record(transfer)
+        running_transfers = [transfer for transfer in running_transfers if transfer.end_time > current_time]
+        for transfer in running_transfers:
+            start_time, rate, bytes_left = rate_segments[transfer][-1]
+            transfer.bytes_left = bytes_left - (current_time - start_time) / microseconds_per_second * rate
+            current_interval.add_transfer(transfer)
+
+        previous_rates = [transfer.current_rate for transfer in running_transfers]
+        previous_OD_count = len(current_interval.OD_transfers)
+        previous_BE_count = len(current_interval.BE_transfers)
+
+        # run the new transfers based on the current heuristic
+        if profiler is None:
+            heuristic(current_interval, queued_OD, queued_BE, network_capacity)
+        else:
+            run_profiled_heuristic(profiler, heuristic, current_interval, queued_OD, queued_BE, network_capacity)
+
+        changed_transfers = []
+        for transfer, previous_rate in zip(running_transfers, previous_rates):
+            if transfer.current_rate != previous_rate:
+                rate_segments[transfer].append((current_time, transfer.current_rate, transfer.bytes_left))
+                changed_transfers.append(transfer)
+
+        if profiler is not None:
+            profiler.count('event intervals')
+            profiler.count('transfers throttled', len(changed_transfers))
+
+        for transfer in current_interval.OD_transfers[previous_OD_count:] + \
+                current_interval.BE_transfers[previous_BE_count:]:
+            rate_segments[transfer] = [(transfer.start_time, transfer.current_rate, transfer.bytes_left)]
+            running_transfers.append(transfer)
+            changed_transfers.append(transfer)
+
+        # the network load changes in the interval a transfer finishes in and in the interval after it
+        for transfer in changed_transfers:
+            end_idx = (transfer.end_time - first_start_time) // interval_length
+            for idx in (end_idx, end_idx + 1):
+                if idx > interval_idx:
+                    heapq.heappush(events, idx)
+
+        # if the heuristic did nothing the next intervals look the same to it until another event happens
+        if len(changed_transfers) > 0 and (len(queued_OD) > 0 or len(queued_BE) > 0):
+            heapq.heappush(events, interval_idx + 1)
+
+    if metrics is not None:
+        for transfer in running_transfers:
+            metrics.record(transfer)
+
+    with profiling.phase('bin_rate_segments'):
+        bin_rate_segments(intervals, rate_segments)
 
     return intervals
 
 
+# add the bytes every transfer sent at each of its rates to the intervals it overlaps
+def bin_rate_segments(intervals, rate_segments):
+    # all of the times are relative to the start of the intervals
+    length = intervals.length
+
+    segment_columns = {TransferType.OD: ([], [], []), TransferType.BE: ([], [], [])}
+    transfer_columns = {TransferType.OD: ([], []), TransferType.BE: ([], [])}
+
+    for transfer, segments in rate_segments.items():
+        if transfer.trans_type not in segment_columns:
+            continue
+        segment_end_times = [start_time for start_time, _, _ in segments[1:]] + [transfer.end_time]
+
+        start_times, end_times, rates = segment_columns[transfer.trans_type]
+        for (start_time, rate, bytes_left), end_time in zip(segments, segment_end_times):
+            start_times.append(start_time - intervals.start_time)
+            end_times.append(end_time - intervals.start_time)
+            rates.append(rate / 1e6)
+
+        # the bytes left once the transfer is done
+        start_time, rate, bytes_left = segments[-1]
+        transfer.bytes_left = bytes_left - (transfer.end_time - start_time) / microseconds_per_second * rate
+
+        start_times, end_times = transfer_columns[transfer.trans_type]
+        start_times.append(transfer.start_time - intervals.start_time)
+        end_times.append(transfer.end_time - intervals.start_time)
+
+    for trans_type, interval_bytes, interval_counts in [(TransferType.OD, intervals.OD_bytes, intervals.OD_counts),
+                                                        (TransferType.BE, intervals.BE_bytes, intervals.BE_counts)]:
+        start_times, end_times, rates = [numpy.array(column) for column in segment_columns[trans_type]]
+        if len(rates) > 0:
+            interval_bytes += bin_transfer_bytes(len(intervals), length, start_times.astype(numpy.int64),
+                                                 end_times.astype(numpy.int64), rates)
+
+        start_times, end_times = [numpy.array(column, dtype=numpy.int64) for column in transfer_columns[trans_type]]
+        interval_counts += bin_transfer_counts(len(intervals), length, start_times, end_times)
+
+
+# vectorized version of running simulate() with every transfer as OD and no BE transfers. Without BE transfers
+# nothing is ever throttled, so each transfer runs at its requested_rate for its requested_transfer_time starting in
+# the first interval after its requested_start_time and the bytes per interval can be summed up with numpy
+def simulate_original(interval_length, date, transfers):
+    intervals = make_day_intervals(interval_length, date)
+    if len(transfers) == 0:
+        return intervals
+
+    # all of the times are relative to the start of the day
+    length = intervals.length
+    requested_start_times = numpy.array([transfer.requested_start_time for transfer in transfers],
+                                        dtype=numpy.int64) - intervals.start_time
+    transfer_times = numpy.array([transfer.requested_transfer_time for transfer in transfers], dtype=numpy.int64)
+    # rates in bytes per microsecond
+    rates = numpy.array([transfer.requested_rate for transfer in transfers], dtype=numpy.float64) / 1e6
+
+    # like simulate(), transfers are started at the start of the first interval after their requested_start_time
+    start_times = (requested_start_times // length + 1) * length
+    end_times = start_times + transfer_times
+
+    intervals.OD_bytes += bin_transfer_bytes(len(intervals), length, start_times, end_times, rates)
+    intervals.OD_counts += bin_transfer_counts(len(intervals), length, start_times, end_times)
+
+    return intervals
+
+
+# sum the bytes of transfers running at a constant rate from start_times to end_times into num_intervals intervals
+# of the given length starting at time 0. Intervals a transfer completely covers get its rate through a difference
+# array, the partially covered intervals at its edges get the bytes of the overlap added separately
+def bin_transfer_bytes(num_intervals, length, start_times, end_times, rates):
+    start_idx = start_times // length
+    end_idx = end_times // length
+    in_one_interval = start_idx == end_idx
+
+    # transfers that start and end in the same interval
+    interval_bytes = numpy.zeros(num_intervals)
+    interval_bytes += partial_interval_bytes(num_intervals, start_idx[in_one_interval],
+                                             (end_times - start_times)[in_one_interval], rates[in_one_interval])
+
+    start_idx = start_idx[~in_one_interval]
+    end_idx = end_idx[~in_one_interval]
+    rates = rates[~in_one_interval]
+
+    # the partial intervals at the start and end of the transfers
+    interval_bytes += partial_interval_bytes(num_intervals, start_idx, (start_idx + 1) * length -
+                                             start_times[~in_one_interval], rates)
+    interval_bytes += partial_interval_bytes(num_intervals, end_idx, end_times[~in_one_interval] - end_idx * length,
+                                             rates)
+
+    # the intervals between them are completely covered
+    rate_changes = numpy.bincount(numpy.clip(start_idx + 1, 0, num_intervals), weights=rates,
+                                  minlength=num_intervals + 1)
+    rate_changes -= numpy.bincount(numpy.clip(end_idx, 0, num_intervals), weights=rates, minlength=num_intervals + 1)
+    interval_bytes += numpy.cumsum(rate_changes[:num_intervals]) * length
+
+    return interval_bytes
+
+
+# count the transfers running in each interval, transfers are counted in every interval that starts before they end
+def bin_transfer_counts(num_intervals, length, start_times, end_times):
+    start_idx = numpy.clip(start_times // length, 0, num_intervals)
+    end_idx = numpy.clip(-(-end_times // length), 0, num_intervals)
+
+    count_changes = numpy.bincount(start_idx, minlength=num_intervals + 1)
+    count_changes -= numpy.bincount(end_idx, minlength=num_intervals + 1)
+    return numpy.cumsum(count_changes[:num_intervals])
+
+
+def partial_interval_bytes(num_intervals, interval_idx, durations, rates):
+    in_range = (interval_idx >= 0) & (interval_idx < num_intervals)
+    return numpy.bincount(interval_idx[in_range], weights=durations[in_range] * rates[in_range],
+                          minlength=num_intervals)
+
+
+# the original per-transfer loop of simulate(), kept as the reference the simulation engines and simulate_original
+# are checked against. It makes every interval from before the first requested_start_time to after the last
+# requested_end_time up front (adding more while transfers are still running), keeps all of them with their transfers
+# and moves the transfers from the sorted lists to the queues with pop(0). Only the intervals of the day are returned
+def simulate_loop(interval_length, date, OD_transfers, BE_transfers, network_capacity, heuristic,
+                  queue_order='arrival', metrics=None):
+    day_intervals = make_day_intervals(interval_length, date)
+    length = day_intervals.length
+
+    unqueued_OD = sorted(OD_transfers, key=attrgetter('requested_start_time'))
+    unqueued_BE = sorted(BE_transfers, key=attrgetter('requested_start_time'))
+    queued_OD = queue_orders[queue_order]()
+    queued_BE = queue_orders[queue_order]()
+
+    # make intervals to use for the simulation
+    interval_start_time = day_intervals.start_time
+    interval_end_time = day_intervals.end_time
+    for unqueued in (unqueued_OD, unqueued_BE):
+        if len(unqueued) > 0:
+            while unqueued[0].requested_start_time < interval_start_time:
+                interval_start_time -= length
+            while max(transfer.requested_end_time for transfer in unqueued) > interval_end_time:
+                interval_end_time += length
+    intervals = [Interval(start_time, length) for start_time in range(interval_start_time, interval_end_time, length)]
+
+    interval_idx = -1
+    current_interval = Interval(interval_start_time - length, length)
+
+    # iterate until all of the transfers have been completely simulated
+    while len(unqueued_OD) > 0 or len(unqueued_BE) or len(queued_OD) > 0 or len(queued_BE) > 0 or\
+            len(current_interval.BE_transfers) > 0 or len(current_interval.OD_transfers) > 0:
+
+        interval_idx += 1
+        if interval_idx >= len(intervals):
+            intervals.append(Interval(intervals[-1].end_time, length))
+
+        previous_interval = current_interval
+        current_interval = intervals[interval_idx]
+
+        # only add the transfers that are still transferring during this interval
+        for transfer in previous_interval.OD_transfers + previous_interval.BE_transfers:
+            if transfer.end_time > current_interval.start_time:
+                current_interval.add_transfer(transfer)
+            elif metrics is not None:
+                metrics.record(transfer)
+
+        # add any unqueued transfers to their queued list
+        while len(unqueued_OD) > 0 and unqueued_OD[0].requested_start_time < current_interval.start_time:
+            queued_OD.push(unqueued_OD.pop(0))
+        while len(unqueued_BE) > 0 and unqueued_BE[0].requested_start_time < current_interval.start_time:
+            queued_BE.push(unqueued_BE.pop(0))
+
+        # run the new transfers based on the current heuristic
+        heuristic(current_interval, queued_OD, queued_BE, network_capacity)
+
+        # update all the transfers by subtracting the bytes transferred during the current interval
+        for transfer in current_interval.OD_transfers + current_interval.BE_transfers:
+            transfer.update_bytes_for_interval(current_interval)
+
+        # Set bytes for current_interval now that we're done with it
+        current_interval.bytes = current_interval.OD_bytes + current_interval.BE_bytes
+
+    # Once the simulation is done, trim the intervals to the day
+    for interval in intervals:
+        day_intervals.record(day_intervals.index(interval.start_time), interval)
+
+    return day_intervals
+
+
+# the simulation engines that can be selected in prepare_simulation
+simulation_engines = {
+    'interval': simulate,
+    'event': simulate_events,
+}
+
+
+# queue of transfers waiting to be run, in the order they were queued
+class ArrivalQueue(object):
+    def __init__(self):
+        self.transfers = deque()
+
+    def push(self, transfer):
+        self.transfers.append(transfer)
+
+    def pop(self):
+        return self.transfers.popleft()
+
+    def peek(self):
+        return self.transfers[0]
+
+    def __len__(self):
+        return len(self.transfers)
+
+
+# queue of transfers waiting to be run, ordered by key(transfer) and then by the order they were queued
+class PriorityQueue(object):
+    def __init__(self, key):
+        self.key = key
+        self.heap = []
+        self.counter = count()
+
+    def push(self, transfer):
+        heapq.heappush(self.heap, (self.key(transfer), next(self.counter), transfer))
+
+    def pop(self):
+        return heapq.heappop(self.heap)[-1]
+
+    def peek(self):
+        return self.heap[0][-1]
+
+    def __len__(self):
+        return len(self.heap)
+
+
+# the orders heuristics can take queued transfers in, each makes an empty queue with push(), pop(), peek() and len()
+queue_orders = {
+    'arrival': ArrivalQueue,
+    'smallest': lambda: PriorityQueue(attrgetter('total_bytes')),
+    'deadline': lambda: PriorityQueue(attrgetter('requested_end_time')),
+}
+
+
 # the baseline heuristic for running transfers
 def baseline_heuristic(current_interval, queued_OD, queued_BE, network_capacity):
     # for job in OD job queue, run job
     while len(queued_OD) > 0:
-        transfer = queued_OD.pop(0)
+        transfer = queued_OD.pop()
         transfer.start_transfer(current_interval.start_time)
         current_interval.add_transfer(transfer)
 
     # for job in BE job queue, if sum of all running jobs < 0.95 * capacity, run job
     while len(queued_BE) > 0 and current_interval.network_load() < 0.95 * network_capacity:
-        transfer = queued_BE.pop(0)
+        transfer = queued_BE.pop()
         transfer.start_transfer(current_interval.start_time)
         current_interval.add_transfer(transfer)
 
 
+# loads within load_tolerance * network_capacity of the 0.95 * network_capacity FCFS_heuristic fills the link up to
+# count as at it. FCFS_heuristic raises BE rates to exactly that load, so a strict comparison with it would flip on
+# rounding errors, which depend on the order an engine adds the rates of an interval up in and on the intervals it runs
+# the heuristic in
+load_tolerance = 1e-9
+
+
 # the baseline heuristic for running transfers
 def FCFS_heuristic(current_interval, queued_OD, queued_BE, network_capacity):
+    tolerance = load_tolerance * network_capacity
+
     # for job in OD job queue, run job
     BE_limiting = False
     while len(queued_OD) > 0:
-        if current_interval.network_load() > 0.95 * network_capacity and BE_limiting is False:
+        if current_interval.network_load() - 0.95 * network_capacity > tolerance and BE_limiting is False:
             BE_limiting = True
             for transfer in current_interval.BE_transfers:
                 # arbitrarily set minimum rate to 100 bytes/sec
                 limiting_rate = 100
-                transfer.update_rate(limiting_rate)
+                transfer.update_rate(limiting_rate, current_interval.start_time)
             current_interval.update_BE_network_load()
 
-        transfer = queued_OD.pop(0)
+        transfer = queued_OD.pop()
         transfer.start_transfer(current_interval.start_time)
         current_interval.add_transfer(transfer)
 
     for transfer in current_interval.BE_transfers:
         available_bandwidth = 0.95 * network_capacity - current_interval.network_load()
-        if available_bandwidth > 0 and transfer.current_rate < transfer.requested_rate:
+        if available_bandwidth > tolerance and transfer.current_rate < transfer.requested_rate:
             new_rate = min(transfer.current_rate + available_bandwidth, transfer.requested_rate)
-            transfer.update_rate(new_rate)
+            transfer.update_rate(new_rate, current_interval.start_time)
 
         current_interval.update_BE_network_load()
 
     # for job in BE job queue, if sum of all running jobs < 0.95 * capacity, run job
-    while len(queued_BE) > 0 and current_interval.network_load() < 0.95 * network_capacity:
-        transfer = queued_BE.pop(0)
+    while len(queued_BE) > 0 and 0.95 * network_capacity - current_interval.network_load() > tolerance:
+        transfer = queued_BE.pop()
         transfer.start_transfer(current_interval.start_time)
         current_interval.add_transfer(transfer)
 
 
-def trim_intervals(original_intervals, date):
-    date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
-
-    trimmed_intervals = []
-    for interval in original_intervals:
-        if interval.start_time < date_time:
-            continue
-        elif interval.start_time >= date_time + datetime.timedelta(days=1):
-            break
-        else:
-            trimmed_intervals.append(interval)
-    return trimmed_intervals
-
-
-def add_interval(intervals):
-    new_interval = Interval(intervals[-1].start_time + intervals[-1].length, intervals[-1].length)
-    intervals.append(new_interval)
-
-
-def make_intervals_given_transfers(interval_length, date, OD_transfers, BE_transfers):
-    # make intervals to use for the simulation
-    date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
-
-    interval_start_time = date_time
-    interval_end_time = date_time + datetime.timedelta(days=1)
+# runs every OD transfer, admits BE transfers like baseline_heuristic and then shares the capacity left by the OD
+# transfers max-min fairly between all of the running BE transfers
+def fair_share_heuristic(current_interval, queued_OD, queued_BE, network_capacity):
+    baseline_heuristic(current_interval, queued_OD, queued_BE, network_capacity)
+    rate_allocation.allocate_BE_rates(current_interval, network_capacity)
 
-    if len(OD_transfers) > 0:
-        while OD_transfers[0].requested_start_time < interval_start_time:
-            interval_start_time -= interval_length
-        while OD_transfers[-1].requested_end_time > interval_end_time:
-            interval_end_time += interval_length
 
-    if len(BE_transfers) > 0:
-        while BE_transfers[0].requested_start_time < interval_start_time:
-            interval_start_time -= interval_length
-        while BE_transfers[-1].requested_end_time > interval_end_time:
-            interval_end_time += interval_length
+# the heuristics that can be selected by name. A heuristic is called at the start of every simulated interval as
+# heuristic(current_interval, queued_OD, queued_BE, network_capacity):
+#  - current_interval is the Interval being simulated, already holding the transfers still running from the previous
+#    interval (OD_transfers, BE_transfers and their bytes in OD_bytes, BE_bytes and network_load())
+#  - queued_OD and queued_BE are the queues (see queue_orders) of the transfers waiting to be run
+#  - network_capacity is the capacity of the network in bytes/second
+# It runs queued transfers with transfer.start_transfer(current_interval.start_time) followed by
+# current_interval.add_transfer(transfer), and may change the rate of running transfers with
+# transfer.update_rate(rate, current_interval.start_time) followed by updating the interval's load
+heuristics = {
+    'baseline': baseline_heuristic,
+    'FCFS': FCFS_heuristic,
+    'fair_share': fair_share_heuristic,
+}
 
-    intervals = make_intervals(interval_length, interval_start_time, interval_end_time)
-    return intervals
 
+# create the folder if it doesn't exist yet. Returns the folder
+def ensure_folder(folder):
+    if not exists(folder):
+        makedirs(folder)
+    return folder
 
-def make_intervals(interval_length, start_time, end_time):
-    intervals = []
-    cur_start_time = start_time
 
-    while cur_start_time < end_time:
-        intervals.append(Interval(cur_start_time, interval_length))
-        cur_start_time += interval_length
+# the intervals of the given day, starting at midnight. interval_length is a timedelta, the intervals are in
+# microseconds
+def make_day_intervals(interval_length, date):
+    date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
+    num_intervals = -(-datetime.timedelta(days=1) // interval_length)
+    return IntervalSeries(to_microseconds(date_time), to_microseconds(interval_length), num_intervals)
+
+
+# the intervals aggregated into intervals of interval_length (a timedelta that is a multiple of their length), so a
+# day simulated once at a fine resolution also gives its coarser series. The bytes of an aggregated interval are the
+# sum of the bytes of the intervals it is made of. Transfers running through several of those intervals would be
+# counted more than once by summing their counts, so the transfers are counted again from their start and end times
+# recorded in metrics (a TransferMetrics) or, without metrics, the counts are the most of any of the intervals
+def aggregate_interval_series(intervals, interval_length, metrics=None):
+    length = to_microseconds(interval_length)
+    if length <= 0 or length % intervals.length != 0:
+        raise ValueError('Can not aggregate intervals of {} into intervals of {}'.
+                         format(to_timedelta(intervals.length), interval_length))
+
+    factor = length // intervals.length
+    num_intervals = -(-len(intervals) // factor)
+    aggregate_intervals = IntervalSeries(intervals.start_time, length, num_intervals)
+    if num_intervals == 0:
+        return aggregate_intervals
+
+    group_starts = numpy.arange(0, len(intervals), factor)
+    aggregate_intervals.OD_bytes = numpy.add.reduceat(intervals.OD_bytes, group_starts)
+    aggregate_intervals.BE_bytes = numpy.add.reduceat(intervals.BE_bytes, group_starts)
+
+    if metrics is None:
+        aggregate_intervals.OD_counts = numpy.maximum.reduceat(intervals.OD_counts, group_starts)
+        aggregate_intervals.BE_counts = numpy.maximum.reduceat(intervals.BE_counts, group_starts)
+        return aggregate_intervals
+
+    trans_types, start_times, end_times = metrics.run_times()
+    for trans_type, counts in [(TransferType.OD, aggregate_intervals.OD_counts),
+                               (TransferType.BE, aggregate_intervals.BE_counts)]:
+        is_type = trans_types == trans_type.value
+        counts += bin_transfer_counts(num_intervals, length, start_times[is_type] - intervals.start_time,
+                                      end_times[is_type] - intervals.start_time)
+
+    return aggregate_intervals
+
+
+# the sum of interval series of the same intervals, e.g. the intervals of several sites on the same day
+def merge_interval_series(intervals_list):
+    first_intervals = intervals_list[0]
+    merged_intervals = IntervalSeries(first_intervals.start_time, first_intervals.length, len(first_intervals))
+
+    for intervals in intervals_list:
+        if (intervals.start_time, intervals.length, len(intervals)) != \
+                (first_intervals.start_time, first_intervals.length, len(first_intervals)):
+            raise ValueError('Can not merge the intervals {} with the intervals {}'.format(intervals, first_intervals))
+
+        merged_intervals.OD_bytes += intervals.OD_bytes
+        merged_intervals.BE_bytes += intervals.BE_bytes
+        merged_intervals.OD_counts += intervals.OD_counts
+        merged_intervals.BE_counts += intervals.BE_counts
+
+    return merged_intervals
+
+
+# the start of the first interval to simulate (in microseconds), the latest interval start (in steps of
+# interval_length from midnight) at or before the requested_start_time of the first OD and BE transfer
+def first_interval_start(interval_length, date, OD_transfers, BE_transfers):
+    interval_start_time = to_microseconds(datetime.datetime(year=date.year, month=date.month, day=date.day))
+    interval_length = to_microseconds(interval_length)
+
+    # the transfer lists are in the (shuffled) order of the OD/BE split, not by requested_start_time
+    for transfers in (OD_transfers, BE_transfers):
+        if len(transfers) == 0:
+            continue
+        first_requested_start_time = min(transfer.requested_start_time for transfer in transfers)
+        if first_requested_start_time < interval_start_time:
+            num_intervals = -((first_requested_start_time - interval_start_time) // interval_length)
+            interval_start_time -= num_intervals * interval_length
 
-    return intervals
+    return interval_start_time
 
 
 def get_interval_statistics(intervals, printer=None):
-    interval_length = intervals[0].length.total_seconds()
-    bytes_per_megabyte = 1024 * 1024
-    interval_rates = [float(interval.bytes) / interval_length for interval in intervals]
+    interval_rates = intervals.network_loads()
 
     mean_value = numpy.mean(interval_rates)
     std_deviation = numpy.std(interval_rates)
     median_value = numpy.median(interval_rates)
 
     if printer is not None:
-        print('\n' + printer)
-        print("mean Interval value: {} MiB/Second".format(mean_value / bytes_per_megabyte))
-        print("median Interval value: {} MiB/Second".format(median_value / bytes_per_megabyte))
-        print("std deviation: {}".format(std_deviation / bytes_per_megabyte))
+        print_interval_statistics((mean_value, std_deviation, median_value), printer)
 
     return mean_value, std_deviation, median_value
+
+
+def print_interval_statistics(statistics, printer):
+    mean_value, std_deviation, median_value = statistics
+    bytes_per_megabyte = 1024 * 1024
+
+    print('\n' + printer)
+    print("mean Interval value: {} MiB/Second".format(mean_value / bytes_per_megabyte))
+    print("median Interval value: {} MiB/Second".format(median_value / bytes_per_megabyte))
+    print("std deviation: {}".format(std_deviation / bytes_per_megabyte))
@@ -0,0 +1,105 @@
+import argparse
+import json
+import urllib.error
+import urllib.request
+
+import simulation_server
+
+
+# send a request (see simulation_server.request_defaults) to a simulation server and return its json answer. Raises
+# ValueError with the server's message for requests it can't simulate or failed to simulate
+def request_simulation(url, request):
+    http_request = urllib.request.Request(url.rstrip('/') + '/simulate', data=json.dumps(request).encode(),
+                                          headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(http_request) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        if error.code in (400, 500):
+            raise ValueError(json.loads(error.read())['error'])
+        raise
+
+
+def server_status(url):
+    with urllib.request.urlopen(url.rstrip('/') + '/status') as response:
+        return json.loads(response.read())
+
+
+def print_day(day, heuristic, OD_percentage):
+    print('\n{} - {} transfers - {:g} MiB/s network capacity{}'.
+          format(day['date'], day['transfers'], day['network_capacity'],
+                 ' (Original intervals cached)' if day['cached']['original'] else ''))
+    for name, statistics in [('Original', day['original']),
+                             ('{} heuristic - OD percentage: {}'.format(heuristic, OD_percentage), day['simulated'])]:
+        print(name)
+        print("mean Interval value: {} MiB/Second".format(statistics['mean']))
+        print("median Interval value: {} MiB/Second".format(statistics['median']))
+        print("std deviation: {}".format(statistics['std deviation']))
+    if day['plot'] is not None:
+        print('plot: {}'.format(day['plot']))
+
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='Simulate the transfers of an xfer log on a simulation server '
+                                                 '(simulation_server.py)',
+                                     epilog='Example: xfer_data_logs/128.142.18.166.xfer 2013-5-1 2013-5-31 '
+                                            '--heuristic fair_share --OD-percentage 0.25')
+    parser.add_argument('file_name', nargs='?', default=None,
+                        help='xfer log file, as seen by the server (relative to the folder it runs in)')
+    parser.add_argument('date', nargs='?', default=None, help="date to simulate ('%%Y-%%m-%%d')")
+    parser.add_argument('last_date', nargs='?', default=None,
+                        help="last date of a range of dates to simulate ('%%Y-%%m-%%d')")
+    parser.add_argument('--url', default='http://127.0.0.1:{}'.format(simulation_server.default_port),
+                        help='url of the simulation server')
+    parser.add_argument('--heuristic', default='baseline', help='heuristic to simulate')
+    parser.add_argument('--engine', default='interval', help='simulation engine')
+    parser.add_argument('--queue-order', default='arrival', help='order queued transfers are run in')
+    parser.add_argument('--interval-length', type=float, default=60, help='interval length in seconds')
+    parser.add_argument('--OD-percentage', type=float, default=0.5, help='OD percentage to simulate')
+    parser.add_argument('--network-capacity', type=float, default=None,
+                        help='network capacity in MiB/s (default: twice the mean of the Original intervals)')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the OD/BE split')
+    parser.add_argument('--plot', action='store_true', help='have the server plot the days it simulates')
+    parser.add_argument('--json', action='store_true', help="print the server's json answer")
+    parser.add_argument('--status', action='store_true', help='print the state of the server and its cache')
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(server_status(args.url), indent=2))
+        return
+    if args.file_name is None or args.date is None:
+        parser.error('the file_name and date are required')
+
+    request = {
+        'log': args.file_name,
+        'date': args.date,
+        'last_date': args.last_date,
+        'heuristic': args.heuristic,
+        'OD_percentage': args.OD_percentage,
+        'network_capacity': args.network_capacity,
+        'interval_length': args.interval_length,
+        'engine': args.engine,
+        'queue_order': args.queue_order,
+        'seed': args.seed,
+        'plot': args.plot,
+    }
+
+    try:
+        result = request_simulation(args.url, request)
+    except ValueError as error:
+        print(error)
+        raise SystemExit(1)
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    for day in result['days']:
+        print_day(day, args.heuristic, args.OD_percentage)
+    print('\nsimulated in {:.3f} seconds'.format(result['seconds']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import sys
+import threading
+import time
+
+import parse_xfer_data_logs
+import simulate
+
+
+bytes_in_MiB = 1024 * 1024
+
+default_port = 8765
+
+# pyplot keeps its figures in global state, so the days simulated in the request threads (with 0 workers) are plotted
+# one at a time
+plot_lock = threading.Lock()
+
+
+# keeps values up to a total size of max_bytes, evicting the least recently used ones to make room. Values are made
+# by get_or_make when they are missing, once even if several threads ask for the same key at the same time
+class LRUCache(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # the lock of every key being made or looked up, with the number of threads holding or waiting for it. A
+        # key lock is dropped once the last of them is done, so only the keys in use have one
+        self.key_locks = {}
+
+    # the value of key and whether it was cached, make() returns the value and its size in bytes
+    def get_or_make(self, key, make):
+        with self.lock:
+            key_lock, users = self.key_locks.get(key, (None, 0))
+            if key_lock is None:
+                key_lock = threading.Lock()
+            self.key_locks[key] = (key_lock, users + 1)
+
+        try:
+            with key_lock:
+                with self.lock:
+                    if key in self.entries:
+                        self.entries.move_to_end(key)
+                        self.hits += 1
+                        return self.entries[key][0], True
+                    self.misses += 1
+
+                value, num_bytes = make()
+                self.put(key, value, num_bytes)
+                return value, False
+        finally:
+            with self.lock:
+                users = self.key_locks[key][1] - 1
+                if users == 0:
+                    del self.key_locks[key]
+                else:
+                    self.key_locks[key] = (key_lock, users)
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+
+    # the newest value is kept even if it is larger than max_bytes on its own
+    def put(self, key, value, num_bytes):
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, num_bytes)
+            self.total_bytes += num_bytes
+
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_bytes) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+                self.evictions += 1
+
+    def status(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'key_locks': len(self.key_locks)}
+
+
+# approximate memory of a parsed and indexed log, the ip addresses are mostly the same few strings
+def transfer_index_bytes(transfer_index):
+    columns = transfer_index.columns
+    num_bytes = sum(array.nbytes for array in (columns.ids, columns.ip_addresses, columns.start_times,
+                                               columns.transfer_times, columns.num_bytes, columns.trans_types,
+                                               transfer_index.order, transfer_index.start_times,
+                                               transfer_index.end_times, transfer_index.max_end_times))
+    return num_bytes + sum(sys.getsizeof(ip_address) for ip_address in set(columns.ip_addresses.tolist()))
+
+
+def interval_series_bytes(intervals):
+    return intervals.OD_bytes.nbytes + intervals.BE_bytes.nbytes + intervals.OD_counts.nbytes + \
+        intervals.BE_counts.nbytes
+
+
+# the simulation requests a SimulationService answers, with their defaults. A request has to give the log and date
+request_defaults = {
+    'last_date': None,
+    'heuristic': 'baseline',
+    'OD_percentage': 0.5,
+    # MiB/s, twice the mean of the Original intervals if not given
+    'network_capacity': None,
+    'interval_length': 60,
+    'engine': 'interval',
+    'queue_order': 'arrival',
+    'seed': None,
+    'plot': False,
+}
+
+
+# simulates requests on logs that are parsed and indexed once and then kept in memory, with the Original intervals of
+# the days simulated before, so asking for more scenarios of a log only simulates them. The logs and the Original
+# intervals are kept in an LRUCache of cache_bytes. The days of the requests are simulated on a pool of workers
+# processes (in the thread of the request with 0 workers), so concurrent requests are simulated at the same time
+class SimulationService(object):
+    def __init__(self, cache_bytes=1024 * bytes_in_MiB, workers=1):
+        self.cache = LRUCache(cache_bytes)
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.started = time.time()
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    # the statistics of a request (a dictionary like request_defaults plus 'log' and 'date'). Raises ValueError for
+    # requests that can't be simulated
+    def simulate(self, request):
+        start_time = time.perf_counter()
+        request = parse_request(request)
+        with self.lock:
+            self.requests += 1
+
+        log_key = log_cache_key(request['log'])
+        transfer_index, log_cached = self.cache.get_or_make(log_key, lambda: load_transfer_index(request['log']))
+
+        tasks = []
+        originals_cached = []
+        for date in request['dates']:
+            date_time = datetime.datetime(year=date.year, month=date.month, day=date.day)
+            indices = transfer_index.indices_in_window(date_time, date_time + datetime.timedelta(days=1))
+
+            original_key = (log_key, date, request['interval_length'])
+            original_intervals = self.cache.get(original_key)
+            originals_cached.append(original_intervals is not None)
+            tasks.append((transfer_index.columns.take(indices), date, original_intervals, request))
+
+        if self.executor is None:
+            day_results = [simulate_request_day(task) for task in tasks]
+        else:
+            day_results = list(self.executor.map(simulate_request_day, tasks))
+
+        days = []
+        for date, original_cached, (day, original_intervals) in zip(request['dates'], originals_cached, day_results):
+            if not original_cached:
+                self.cache.put((log_key, date, request['interval_length']), original_intervals,
+                               interval_series_bytes(original_intervals))
+            day['cached'] = {'log': log_cached, 'original': original_cached}
+            days.append(day)
+
+        return {
+            'log': request['log'],
+            'heuristic': request['heuristic'],
+            'OD_percentage': request['OD_percentage'],
+            'days': days,
+            'seconds': time.perf_counter() - start_time,
+        }
+
+    def status(self):
+        return {'requests': self.requests, 'uptime_seconds': time.time() - self.started, 'cache': self.cache.status()}
+
+
+# a request with its defaults filled in and its values checked, the dates of the request are in 'dates'
+def parse_request(request):
+    if not isinstance(request, dict):
+        raise ValueError('A request has to be a json object')
+    for key in ('log', 'date'):
+        if key not in request:
+            raise ValueError("A request needs a '{}'".format(key))
+    unknown_keys = set(request) - set(request_defaults) - {'log', 'date'}
+    if len(unknown_keys) > 0:
+        raise ValueError('Unknown request keys: {}'.format(', '.join(sorted(unknown_keys))))
+
+    request = dict(request_defaults, **request)
+    if not os.path.isfile(request['log']):
+        raise ValueError('Not a log file: {}'.format(request['log']))
+    request['log'] = os.path.abspath(request['log'])
+
+    dates = [datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
+             for date_str in [request['date'], request['last_date'] or request['date']]]
+    request['dates'] = [dates[0] + datetime.timedelta(days=i) for i in range((dates[1] - dates[0]).days + 1)]
+    if len(request['dates']) == 0:
+        raise ValueError('The last date is before the first date')
+
+    for key, choices in [('heuristic', simulate.heuristics), ('engine', simulate.simulation_engines),
+                         ('queue_order', simulate.queue_orders)]:
+        if request[key] not in choices:
+            raise ValueError('{} has to be one of {}'.format(key, ', '.join(sorted(choices))))
+    if not 0 <= request['OD_percentage'] <= 1:
+        raise ValueError('OD_percentage has to be between 0 and 1')
+    if request['network_capacity'] is not None and request['network_capacity'] <= 0:
+        raise ValueError('network_capacity has to be positive')
+    # the intervals are simulated in whole microseconds
+    if datetime.timedelta(seconds=request['interval_length']) < datetime.timedelta(microseconds=1):
+        raise ValueError('interval_length has to be at least a microsecond')
+
+    return request
+
+
+# the key of a log in the cache, a log that changed is loaded again
+def log_cache_key(file_name):
+    stat = os.stat(file_name)
+    return file_name, stat.st_size, stat.st_mtime_ns
+
+
+def load_transfer_index(file_name):
+    transfer_index = parse_xfer_data_logs.TransferIndex(parse_xfer_data_logs.load_log_columns(file_name))
+    return transfer_index, transfer_index_bytes(transfer_index)
+
+
+# simulate a day of a request, run on the workers. Returns the statistics of the day and its Original intervals
+def simulate_request_day(task):
+    columns, date, original_intervals, request = task
+    transfers = columns.transfers()
+    interval_length = datetime.timedelta(seconds=request['interval_length'])
+
+    if original_intervals is None:
+        original_intervals = simulate.simulate_original(interval_length, date, transfers)
+    original_statistics = simulate.get_interval_statistics(original_intervals)
+
+    if request['network_capacity'] is None:
+        network_capacity = original_statistics[0] * 2
+    else:
+        network_capacity = request['network_capacity'] * bytes_in_MiB
+
+    heuristic_tup = (request['heuristic'], simulate.heuristics[request['heuristic']])
+    scenario = simulate.make_scenario(interval_length, date, heuristic_tup, request['engine'], request['queue_order'],
+                                      request['seed'], network_capacity=network_capacity)
+    new_intervals, metrics = simulate.simulate_OD_scenario(transfers, request['OD_percentage'], scenario)
+
+    plot_filename = None
+    if request['plot'] and len(transfers) > 0:
+        import make_plot
+        file_name = os.path.basename(request['log'])
+        plot_filename = os.path.abspath("plots-xfer_data_logs/{}/{}_{}_{}-transfers_{:.2f}-OD_{}_{:g}-MiB.png".
+                                        format(request['heuristic'], file_name, date, len(transfers),
+                                               request['OD_percentage'], request['heuristic'],
+                                               network_capacity / bytes_in_MiB))
+        plot_title = "{} - {} Heuristic on {} - {} Transfers".format(file_name, request['heuristic'], date,
+                                                                     len(transfers))
+        with plot_lock:
+            make_plot.plot_intervals(plot_filename, plot_title,
+                                     [('Original', original_intervals),
+                                      ('{}% OD'.format(request['OD_percentage'] * 100), new_intervals)])
+
+    day = {
+        'date': str(date),
+        'transfers': len(transfers),
+        'network_capacity': network_capacity / bytes_in_MiB,
+        'original': statistics_in_MiB(original_statistics),
+        'simulated': statistics_in_MiB(simulate.get_interval_statistics(new_intervals)),
+        'transfer_outcomes': metrics.summary(),
+        'plot': plot_filename,
+    }
+    return day, original_intervals
+
+
+# (mean, std deviation, median) in bytes/second as a dictionary of MiB/s
+def statistics_in_MiB(statistics):
+    return {name: float(value) / bytes_in_MiB for name, value in zip(('mean', 'std deviation', 'median'), statistics)}
+
+
+# POST /simulate with a json request answers with the json statistics, GET /status with the state of the service.
+# Errors are answered with {'error': message}
+class SimulationRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(200, self.server.service.status())
+        else:
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/simulate':
+            self.send_json(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            self.send_json(200, self.server.service.simulate(request))
+        except (ValueError, TypeError) as error:
+            self.send_json(400, {'error': str(error)})
+        except Exception as error:
+            # every request is answered, even when the simulation fails
+            self.log_error('%s', repr(error))
+            self.send_json(500, {'error': '{}: {}'.format(type(error).__name__, error)})
+
+    def send_json(self, status, value):
+        body = json.dumps(value).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# http server answering every request on a thread of its own with a SimulationService
+class SimulationServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        self.service = service
+        ThreadingHTTPServer.__init__(self, address, SimulationRequestHandler)
+
+
+def main():
+    '''Main function'''
+
+    parser = argparse.ArgumentParser(description='Serve simulations of xfer logs that are kept in memory between '
+                                                 'requests',
+                                     epilog='Requests are sent with simulation_client.py or as json to '
+                                            'POST /simulate, GET /status shows the cache')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=default_port, help='port to listen on')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of processes simulating the requests (0 simulates them in the request threads)')
+    parser.add_argument('--cache-size', type=float, default=1024,
+                        help='MiB of parsed logs and Original intervals to keep in memory')
+    parser.add_argument('--preload', nargs='+', default=[], help='xfer logs to parse before serving')
+    args = parser.parse_args()
+
+    service = SimulationService(int(args.cache_size * bytes_in_MiB), args.workers)
+    for file_name in args.preload:
+        service.cache.get_or_make(log_cache_key(os.path.abspath(file_name)),
+                                  lambda: load_transfer_index(os.path.abspath(file_name)))
+
+    server = SimulationServer((args.host, args.port), service)
+    print('Serving simulations on http://{}:{} with {} workers'.format(args.host, server.server_address[1],
+                                                                       args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
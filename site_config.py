@@ -0,0 +1,99 @@
+import ipaddress
+from operator import attrgetter
+from os.path import isfile
+import sys
+
+
+bytes_in_MiB = 1024 * 1024
+
+
+# the sites (links) the transfers of a log are simulated on when they are simulated per site, and their network
+# capacities in bytes/second. A site is an ip address or a subnet, every transfer is on the most specific site its
+# ip_address is in. Transfers with an ip_address that isn't in any of the sites are on a site of their own ip_address
+# with the default capacity, or with a capacity taken from their Original simulation if there is no default
+class SiteConfig(object):
+    def __init__(self, default_capacity=None):
+        self.default_capacity = default_capacity
+        self.networks = []
+        self.capacities = {}
+        self.site_cache = {}
+
+    def add_site(self, address, capacity):
+        network = ipaddress.ip_network(address, strict=False)
+        site = site_name(network)
+        if site in self.capacities:
+            raise ValueError('site {} is given more than once'.format(site))
+
+        self.networks.append(network)
+        # the most specific networks are looked at first
+        self.networks.sort(key=attrgetter('prefixlen'), reverse=True)
+        self.capacities[site] = capacity
+        self.site_cache.clear()
+
+    def __len__(self):
+        return len(self.networks)
+
+    # the name of the site of a transfer's ip_address
+    def site_of(self, ip_address):
+        if ip_address not in self.site_cache:
+            try:
+                address = ipaddress.ip_address(ip_address)
+            except ValueError:
+                address = None
+
+            site = ip_address
+            for network in self.networks:
+                if address is not None and address.version == network.version and address in network:
+                    site = site_name(network)
+                    break
+            self.site_cache[ip_address] = site
+
+        return self.site_cache[ip_address]
+
+    # the network capacity (bytes/second) of a site, None if the capacity has to be taken from the transfers
+    def capacity(self, site):
+        return self.capacities.get(site, self.default_capacity)
+
+
+# single addresses are named by the address, subnets by the subnet ('10.0.0.0/24')
+def site_name(network):
+    if network.prefixlen == network.max_prefixlen:
+        return str(network.network_address)
+    return str(network)
+
+
+# read a site config file. Every line is an ip address or a subnet and its network capacity in MiB/s, a line
+# 'default <capacity>' gives the capacity of all other ip addresses and everything after a '#' is a comment:
+#   10.0.0.0/24   400     # all of the endpoints of the subnet share one link
+#   10.0.1.7      120
+#   default       100
+def load_site_config(file_name):
+    if not isfile(file_name):
+        print("ERROR - Provided site config file is not valid: '{}'".format(file_name))
+        sys.exit(1)
+
+    site_config = SiteConfig()
+    with open(file_name, 'r') as file_in:
+        for line_number, line in enumerate(file_in, 1):
+            line_values = line.split('#', 1)[0].split()
+            if len(line_values) == 0:
+                continue
+
+            try:
+                if len(line_values) != 2:
+                    raise ValueError('expected an address and a capacity')
+                address, capacity = line_values[0], float(line_values[1]) * bytes_in_MiB
+                if capacity <= 0:
+                    raise ValueError('the capacity has to be positive')
+
+                if address == 'default':
+                    site_config.default_capacity = capacity
+                else:
+                    site_config.add_site(address, capacity)
+            except ValueError as error:
+                print("ERROR - Could not parse line {} of site config file '{}': {}".format(line_number, file_name,
+                                                                                            error))
+                print(line.rstrip())
+                sys.exit(1)
+
+    return site_config
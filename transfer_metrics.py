@@ -0,0 +1,123 @@
+import numpy
+
+from parse_xfer_data_logs import TransferType, microseconds_per_second
+
+
+# names of the per transfer outcomes, all in seconds except for the slowdown:
+#  - wait: time from the requested start to the actual start
+#  - completion: time from the requested start to the end
+#  - delay: time the transfer ended after its requested end
+#  - slowdown: completion time divided by the requested transfer time
+outcome_names = ['wait', 'completion', 'delay', 'slowdown']
+
+default_percentiles = [50, 90, 95, 99]
+
+
+# records the outcome of every transfer as it finishes during a simulation. Recording only appends the transfer's
+# times to lists, they are turned into numpy arrays once the outcomes are asked for
+class TransferMetrics(object):
+    def __init__(self):
+        self.transfer_ids = []
+        self.total_bytes = []
+        self.trans_types = []
+        self.requested_start_times = []
+        self.requested_transfer_times = []
+        self.start_times = []
+        self.end_times = []
+
+    def record(self, transfer):
+        self.transfer_ids.append(transfer.transfer_id)
+        self.total_bytes.append(transfer.total_bytes)
+        self.trans_types.append(transfer.trans_type.value)
+        self.requested_start_times.append(transfer.requested_start_time)
+        self.requested_transfer_times.append(transfer.requested_transfer_time)
+        self.start_times.append(transfer.start_time)
+        self.end_times.append(transfer.end_time)
+
+    # add the transfers recorded in another TransferMetrics, e.g. one of another site
+    def extend(self, metrics):
+        self.transfer_ids.extend(metrics.transfer_ids)
+        self.total_bytes.extend(metrics.total_bytes)
+        self.trans_types.extend(metrics.trans_types)
+        self.requested_start_times.extend(metrics.requested_start_times)
+        self.requested_transfer_times.extend(metrics.requested_transfer_times)
+        self.start_times.extend(metrics.start_times)
+        self.end_times.extend(metrics.end_times)
+
+    def __len__(self):
+        return len(self.trans_types)
+
+    # the trans_type value of every recorded transfer and a dictionary from the outcome names to their arrays
+    def outcomes(self):
+        requested_start_times = numpy.array(self.requested_start_times, dtype=numpy.int64)
+        requested_transfer_times = numpy.array(self.requested_transfer_times, dtype=numpy.int64)
+        start_times = numpy.array(self.start_times, dtype=numpy.int64)
+        end_times = numpy.array(self.end_times, dtype=numpy.int64)
+
+        completion = end_times - requested_start_times
+        outcomes = {
+            'wait': (start_times - requested_start_times) / microseconds_per_second,
+            'completion': completion / microseconds_per_second,
+            'delay': (completion - requested_transfer_times) / microseconds_per_second,
+            'slowdown': completion / requested_transfer_times,
+        }
+        return numpy.array(self.trans_types, dtype=numpy.int8), outcomes
+
+    # the trans_type values and the start and end times (microseconds since the epoch) of the recorded transfers
+    def run_times(self):
+        return (numpy.array(self.trans_types, dtype=numpy.int8), numpy.array(self.start_times, dtype=numpy.int64),
+                numpy.array(self.end_times, dtype=numpy.int64))
+
+    # the recorded transfers and their outcomes as a dictionary of columns, in the order they finished
+    def columns(self):
+        trans_types, outcomes = self.outcomes()
+        columns = {
+            'transfer_id': numpy.array(self.transfer_ids, dtype=numpy.int64),
+            'trans_type': trans_types,
+            'total_bytes': numpy.array(self.total_bytes, dtype=numpy.int64),
+            'requested_start_time': numpy.array(self.requested_start_times, dtype=numpy.int64).astype('datetime64[us]'),
+            'requested_transfer_time': numpy.array(self.requested_transfer_times, dtype=numpy.int64) /
+            microseconds_per_second,
+            'start_time': numpy.array(self.start_times, dtype=numpy.int64).astype('datetime64[us]'),
+            'end_time': numpy.array(self.end_times, dtype=numpy.int64).astype('datetime64[us]'),
+        }
+        columns.update((outcome_name, outcomes[outcome_name]) for outcome_name in outcome_names)
+        return columns
+
+    # the count, mean, percentiles and maximum of every outcome for the OD and BE transfers
+    def summary(self, percentiles=default_percentiles):
+        trans_types, outcomes = self.outcomes()
+
+        summary = {}
+        for trans_type in TransferType:
+            in_class = trans_types == trans_type.value
+            class_summary = {'count': int(in_class.sum())}
+
+            for outcome_name in outcome_names:
+                values = outcomes[outcome_name][in_class]
+                if len(values) == 0:
+                    continue
+                class_summary[outcome_name] = {
+                    'mean': float(values.mean()),
+                    'max': float(values.max()),
+                    'percentiles': dict(zip(percentiles, numpy.percentile(values, percentiles).tolist())),
+                }
+            summary[trans_type.name] = class_summary
+
+        return summary
+
+
+def print_summary(summary, printer=None):
+    if printer is not None:
+        print('\n' + printer)
+
+    for class_name, class_summary in summary.items():
+        print('{} transfers: {}'.format(class_name, class_summary['count']))
+        for outcome_name in outcome_names:
+            if outcome_name not in class_summary:
+                continue
+            outcome = class_summary[outcome_name]
+            percentiles = ', '.join('p{}: {:.2f}'.format(percentile, value)
+                                    for percentile, value in outcome['percentiles'].items())
+            print('    {:>10} - mean: {:.2f}, {}, max: {:.2f}'.format(outcome_name, outcome['mean'], percentiles,
+                                                                     outcome['max']))